@@ -1,4 +1,27 @@
+from abc import ABC, abstractmethod
 from enum import Enum
+from array import array
+from collections import deque
+from contextlib import nullcontext, redirect_stdout
+from itertools import islice
+import asyncio
+import heapq
+import io
+import json
+import math
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+
+try:
+    import numpy as np  # optional: only TariffEngine.price_batch uses it
+except ImportError:
+    np = None
 
 
 class VehicleType(Enum):
@@ -13,7 +36,19 @@ class SpotType(Enum):
     LARGE = 3
 
 
+NO_LOCK = nullcontext()  # stands in for a lock when the lot is not in concurrent mode
+
+# Spot types a vehicle can use, smallest first. Allocation tries them in this order
+FITTING_SPOTS = {
+    VehicleType.MOTORCYCLE: (SpotType.MOTORCYCLE, SpotType.COMPACT, SpotType.LARGE),
+    VehicleType.CAR: (SpotType.COMPACT, SpotType.LARGE),
+    VehicleType.TRUCK: (SpotType.LARGE,),
+}
+
+
 class Vehicle:
+    __slots__ = ("license_plate",)
+
     def __init__(self, license_plate: str):
         self.license_plate = license_plate
 
@@ -22,115 +57,1793 @@ class Vehicle:
 
 
 class Motorcycle(Vehicle):
+    __slots__ = ()
+
     def get_type(self):
         return VehicleType.MOTORCYCLE
 
 
 class Car(Vehicle):
+    __slots__ = ()
+
     def get_type(self):
         return VehicleType.CAR
 
 
 class Truck(Vehicle):
+    __slots__ = ()
+
     def get_type(self):
         return VehicleType.TRUCK
 
 
+VEHICLE_CLASSES = {
+    VehicleType.MOTORCYCLE: Motorcycle,
+    VehicleType.CAR: Car,
+    VehicleType.TRUCK: Truck,
+}
+
+
 class ParkingSpot:
+    __slots__ = ("spot_id", "spot_type", "occupied", "vehicle", "level")
+
     def __init__(self, spot_id: str, spot_type: SpotType):
         self.spot_id = spot_id
         self.spot_type = spot_type
         self.occupied = False
         self.vehicle = None
+        self.level = None  # owning Level, kept up to date on park/remove
 
     def can_fit_vehicle(self, vehicle: Vehicle) -> bool:
-        vt = vehicle.get_type()
-        if vt == VehicleType.MOTORCYCLE:
-            return True
-        elif vt == VehicleType.CAR:
-            return self.spot_type in {SpotType.COMPACT, SpotType.LARGE}
-        elif vt == VehicleType.TRUCK:
-            return self.spot_type == SpotType.LARGE
-        return False
+        return self.spot_type in FITTING_SPOTS.get(vehicle.get_type(), ())
+
+    def _lock(self):
+        return self.level.lock if self.level is not None else NO_LOCK
 
     def park_vehicle(self, vehicle: Vehicle) -> bool:
-        if not self.occupied and self.can_fit_vehicle(vehicle):
-            self.vehicle = vehicle
-            self.occupied = True
-            return True
-        return False
+        # Check-and-claim is atomic under the level lock, so two gates can never
+        # both see occupied == False and book the same spot
+        with self._lock():
+            if not self.occupied and self.can_fit_vehicle(vehicle):
+                self.vehicle = vehicle
+                self.occupied = True
+                if self.level is not None:
+                    self.level._spot_taken(self)
+                return True
+            return False
 
     def remove_vehicle(self):
-        self.vehicle = None
-        self.occupied = False
+        with self._lock():
+            was_occupied = self.occupied
+            self.vehicle = None
+            self.occupied = False
+            if was_occupied and self.level is not None:
+                self.level._spot_freed(self)
 
 
-class Level:
-    def __init__(self, level_num: int, spots: list[ParkingSpot]):
+class LevelBase(ABC):
+    # Free-spot bookkeeping shared by both storage layouts: one min-heap of free spots
+    # per SpotType, ordered by the allocation strategy's spot key (default: when the spot
+    # was added) -> O(log n) park/leave. A heap entry goes stale once its spot is taken
+    # or removed; stale entries are popped off the top after every change. Subclasses
+    # decide how spots are stored, what an entry looks like and how a spot is claimed.
+    def __init__(self, level_num: int):
         self.level_num = level_num
-        self.spots = spots
+        self.lock = NO_LOCK  # ParkingLot(concurrent=True) swaps in a real RLock
+        self._lot = None  # set by ParkingLot so spot changes can update its index
+        self._spot_key = None  # set by ParkingLot from its AllocationStrategy
+        self._free = {spot_type: [] for spot_type in SpotType}
+        self._deferred = set()  # SpotTypes a park_many batch re-indexes itself, at the end
+        # Free spots per SpotType, updated as spots are taken and freed
+        self.free_counts = {spot_type: 0 for spot_type in SpotType}
+        self.spot_counts = {spot_type: 0 for spot_type in SpotType}  # all live spots
+        # Free spots kept back for bookings about to start (set by a ReservationBook)
+        self.reserved = {spot_type: 0 for spot_type in SpotType}
 
-    def park_vehicle(self, vehicle: Vehicle) -> ParkingSpot:
-        for spot in self.spots:
-            if spot.park_vehicle(vehicle):
-                return spot
-        return None
+    @property
+    @abstractmethod
+    def spots(self) -> list[ParkingSpot]:
+        pass
+
+    @abstractmethod
+    def _add_spot(self, spot) -> ParkingSpot:
+        pass
+
+    @abstractmethod
+    def _remove_spot(self, spot_id: str) -> ParkingSpot:
+        pass
+
+    @abstractmethod
+    def get_spot(self, spot_id: str) -> ParkingSpot:
+        pass
+
+    @abstractmethod
+    def _entry(self, handle):
+        # Heap entry for a free spot, given the layout's handle for it
+        pass
+
+    @abstractmethod
+    def _entry_handle(self, entry):
+        pass
+
+    @abstractmethod
+    def _entry_key(self, entry):
+        pass
+
+    @abstractmethod
+    def _is_live(self, spot_type: SpotType, entry) -> bool:
+        pass
+
+    @abstractmethod
+    def _take(self, entry, vehicle: Vehicle) -> ParkingSpot:
+        # Claim a live entry's spot for vehicle: -> the spot, or None if it was lost
+        pass
+
+    def add_spot(self, spot) -> ParkingSpot:
+        with self.lock:
+            return self._add_spot(spot)
+
+    def remove_spot(self, spot_id: str) -> ParkingSpot:
+        with self.lock:
+            return self._remove_spot(spot_id)
+
+    def set_spot_key(self, spot_key):
+        # spot_key(spot) -> comparable, smallest is handed out first; None = insertion order
+        with self.lock:
+            live = {
+                spot_type: [self._entry_handle(e) for e in heap if self._is_live(spot_type, e)]
+                for spot_type, heap in self._free.items()
+            }
+            self._spot_key = spot_key
+            for spot_type, handles in live.items():
+                heap = self._free[spot_type]
+                heap[:] = [self._entry(handle) for handle in handles]
+                heapq.heapify(heap)
+                self._changed(spot_type)
+
+    def _changed(self, spot_type: SpotType):
+        # Keep the heap top live so top_key() is a plain read, then let the lot re-index
+        heap = self._free[spot_type]
+        while heap and not self._is_live(spot_type, heap[0]):
+            heapq.heappop(heap)
+        if self._lot is not None and spot_type not in self._deferred:
+            self._lot._touch(self, spot_type)
+
+    def defer_index(self, spot_type: SpotType):
+        # Stop re-indexing spot_type on every change until resume_index
+        with self.lock:
+            self._deferred.add(spot_type)
+
+    def resume_index(self, spot_type: SpotType):
+        with self.lock:
+            self._deferred.discard(spot_type)
+            self._changed(spot_type)
+
+    def _mark_added(self, spot_type: SpotType, handle):
+        self.spot_counts[spot_type] += 1
+        self._mark_freed(spot_type, handle)
+
+    def _mark_removed(self, spot_type: SpotType):
+        # The spot's heap entry must already fail _is_live
+        self.spot_counts[spot_type] -= 1
+        self.free_counts[spot_type] -= 1
+        self._changed(spot_type)
+
+    def _mark_taken(self, spot_type: SpotType):
+        self.free_counts[spot_type] -= 1
+        self._changed(spot_type)
+
+    def _mark_freed(self, spot_type: SpotType, handle):
+        self.free_counts[spot_type] += 1
+        heapq.heappush(self._free[spot_type], self._entry(handle))
+        self._changed(spot_type)
+
+    def has_free(self, spot_type: SpotType) -> bool:
+        # Free for a walk-in: spots kept back for upcoming bookings don't count
+        return self.free_counts[spot_type] > self.reserved[spot_type]
+
+    def keep_back(self, spot_type: SpotType, change: int):
+        # Adjust how many free spot_type spots walk-ins must leave alone
+        with self.lock:
+            self.reserved[spot_type] += change
+            self._changed(spot_type)
+
+    def top_key(self, spot_type: SpotType):
+        # Key of the spot that would be handed out next for this type (None if full)
+        heap = self._free[spot_type]
+        return self._entry_key(heap[0]) if heap else None
+
+    def park_vehicle(self, vehicle: Vehicle, spot_types=None, walk_in: bool = True) -> ParkingSpot:
+        # spot_types narrows the search (the lot passes the type its strategy picked);
+        # walk-ins cannot take the spots kept back for bookings, reservation holds can
+        if spot_types is None:
+            spot_types = FITTING_SPOTS.get(vehicle.get_type(), ())
+        with self.lock:
+            for spot_type in spot_types:  # smallest first
+                if walk_in and not self.has_free(spot_type):
+                    continue
+                heap = self._free[spot_type]
+                while heap:
+                    entry = heapq.heappop(heap)
+                    if self._is_live(spot_type, entry):
+                        spot = self._take(entry, vehicle)
+                        if spot is not None:
+                            return spot
+            return None
 
     def free_spot(self, spot_id: str):
-        for spot in self.spots:
-            if spot.spot_id == spot_id:
-                spot.remove_vehicle()
-                break
+        spot = self.get_spot(spot_id)
+        if spot is not None:
+            spot.remove_vehicle()  # puts it back in the free heap
+        return spot
 
     def get_available_spots(self):
         return [spot for spot in self.spots if not spot.occupied]
 
+    def get_available_count(self) -> int:
+        return sum(self.free_counts.values())
+
+
+class Level(LevelBase):
+    # One ParkingSpot object per spot. Heap entries are (key, order, spot); order is
+    # when the spot was added and tells a removed-and-re-added spot_id apart.
+    def __init__(self, level_num: int, spots: list[ParkingSpot]):
+        super().__init__(level_num)
+        self._spots = []
+        self._spots_by_id = {}  # spot_id -> ParkingSpot, O(1) lookup on leave
+        self._order = {}  # spot_id -> order of the live spot with that id
+        self._next_order = 0
+        for spot in spots:
+            self.add_spot(spot)
+
+    @property
+    def spots(self) -> list[ParkingSpot]:
+        return self._spots
+
+    def _add_spot(self, spot: ParkingSpot) -> ParkingSpot:
+        if spot.spot_id in self._spots_by_id:
+            raise ValueError(f"Spot {spot.spot_id} already exists on level {self.level_num}")
+        self._spots.append(spot)
+        self._spots_by_id[spot.spot_id] = spot
+        self._order[spot.spot_id] = self._next_order
+        self._next_order += 1
+        spot.level = self
+        if spot.occupied:
+            self.spot_counts[spot.spot_type] += 1
+        else:
+            self._mark_added(spot.spot_type, spot)
+        return spot
+
+    def _remove_spot(self, spot_id: str) -> ParkingSpot:
+        spot = self._spots_by_id.get(spot_id)
+        if spot is None:
+            return None
+        if spot.occupied:
+            raise ValueError(f"Spot {spot_id} is occupied and cannot be removed")
+        del self._spots_by_id[spot_id]
+        del self._order[spot_id]  # its heap entry is now stale and gets skipped
+        self._spots.remove(spot)
+        spot.level = None
+        self._mark_removed(spot.spot_type)
+        return spot
+
+    def get_spot(self, spot_id: str) -> ParkingSpot:
+        return self._spots_by_id.get(spot_id)
+
+    def _entry(self, spot: ParkingSpot):
+        order = self._order[spot.spot_id]
+        key = self._spot_key(spot) if self._spot_key is not None else order
+        return (key, order, spot)
+
+    def _entry_handle(self, entry) -> ParkingSpot:
+        return entry[2]
+
+    def _entry_key(self, entry):
+        return entry[0]
+
+    def _is_live(self, spot_type: SpotType, entry) -> bool:
+        _, order, spot = entry
+        return self._order.get(spot.spot_id) == order and not spot.occupied
+
+    def _take(self, entry, vehicle: Vehicle) -> ParkingSpot:
+        spot = entry[2]
+        return spot if spot.park_vehicle(vehicle) else None
+
+    # Called by ParkingSpot.park_vehicle/remove_vehicle
+    def _spot_taken(self, spot: ParkingSpot):
+        self._mark_taken(spot.spot_type)
+
+    def _spot_freed(self, spot: ParkingSpot):
+        self._mark_freed(spot.spot_type, spot)
+
+
+# ---------------------------------------------------------------------------------------------------
+# Compact storage for very large lots: instead of one ParkingSpot object per spot, a
+# CompactLevel keeps parallel arrays (1 byte spot type, 1 byte occupancy, 4 byte vehicle
+# slot) and hands out thin CompactSpot views, so it drops into a ParkingLot unchanged.
+
+SPOT_TYPE_BY_CODE = {spot_type.value: spot_type for spot_type in SpotType}
+
+
+class CompactSpot(ParkingSpot):
+    # View over one row of a CompactLevel; reads and writes go to the level's arrays
+    __slots__ = ("_index",)
+
+    def __init__(self, level: "CompactLevel", index: int):
+        self.level = level
+        self._index = index
+
+    @property
+    def spot_id(self) -> str:
+        return self.level.id_prefix + str(self._index)
+
+    @property
+    def spot_type(self) -> SpotType:
+        return SPOT_TYPE_BY_CODE[self.level._types[self._index]]
+
+    @property
+    def occupied(self) -> bool:
+        return bool(self.level._occupied[self._index])
+
+    @property
+    def vehicle(self) -> Vehicle:
+        slot = self.level._vehicle_slot[self._index]
+        return self.level._vehicles[slot] if slot >= 0 else None
+
+    def park_vehicle(self, vehicle: Vehicle) -> bool:
+        with self._lock():
+            if not self.occupied and self.can_fit_vehicle(vehicle):
+                self.level._claim(self._index, vehicle)
+                return True
+            return False
+
+    def remove_vehicle(self):
+        with self._lock():
+            self.level._release(self._index)
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, CompactSpot)
+            and other.level is self.level
+            and other._index == self._index
+        )
+
+    def __hash__(self):
+        return hash((id(self.level), self._index))
+
+
+class CompactLevel(LevelBase):
+    # Same interface as Level. Spot ids are positional ("L{level_num}-S{index}"), so
+    # spots are added by type and looked up by parsing the id instead of a dict.
+    # Heap entries are spot indexes (index order == insertion order); with a strategy
+    # spot key they become (key, index).
+    def __init__(self, level_num: int, spot_types: list[SpotType]):
+        super().__init__(level_num)
+        self.id_prefix = f"L{level_num}-S"
+        self._types = bytearray()  # SpotType.value per spot, 0 once the spot is removed
+        self._occupied = bytearray()  # 1 if occupied
+        self._vehicle_slot = array("i")  # index into self._vehicles, -1 if empty
+        self._vehicles = []  # vehicle table, slots are recycled via _free_slots
+        self._free_slots = []
+        for spot_type in spot_types:
+            self._add_spot(spot_type)
+
+    @property
+    def spots(self) -> list[CompactSpot]:
+        return [CompactSpot(self, i) for i, code in enumerate(self._types) if code]
+
+    def _add_spot(self, spot_type: SpotType) -> CompactSpot:
+        index = len(self._types)
+        self._types.append(spot_type.value)
+        self._occupied.append(0)
+        self._vehicle_slot.append(-1)
+        self._mark_added(spot_type, index)
+        return CompactSpot(self, index)
+
+    def _entry(self, index: int):
+        if self._spot_key is None:
+            return index
+        return (self._spot_key(CompactSpot(self, index)), index)
+
+    def _entry_handle(self, entry) -> int:
+        return entry if self._spot_key is None else entry[1]
+
+    def _entry_key(self, entry):
+        return entry if self._spot_key is None else entry[0]
+
+    def _is_live(self, spot_type: SpotType, entry) -> bool:
+        index = self._entry_handle(entry)
+        return self._types[index] == spot_type.value and not self._occupied[index]
+
+    def _take(self, entry, vehicle: Vehicle) -> CompactSpot:
+        index = self._entry_handle(entry)
+        self._claim(index, vehicle)
+        return CompactSpot(self, index)
+
+    def _index_of(self, spot_id: str):
+        if not spot_id.startswith(self.id_prefix):
+            return None
+        rest = spot_id[len(self.id_prefix) :]
+        if not rest.isdigit():
+            return None
+        index = int(rest)
+        return index if index < len(self._types) and self._types[index] else None
+
+    def _remove_spot(self, spot_id: str) -> CompactSpot:
+        index = self._index_of(spot_id)
+        if index is None:
+            return None
+        if self._occupied[index]:
+            raise ValueError(f"Spot {spot_id} is occupied and cannot be removed")
+        spot_type = SPOT_TYPE_BY_CODE[self._types[index]]
+        self._types[index] = 0  # its heap entry is now stale and gets skipped
+        self._mark_removed(spot_type)
+        return CompactSpot(self, index)
+
+    def get_spot(self, spot_id: str) -> CompactSpot:
+        index = self._index_of(spot_id)
+        return CompactSpot(self, index) if index is not None else None
+
+    def _claim(self, index: int, vehicle: Vehicle):
+        if self._free_slots:
+            slot = self._free_slots.pop()
+            self._vehicles[slot] = vehicle
+        else:
+            slot = len(self._vehicles)
+            self._vehicles.append(vehicle)
+        self._vehicle_slot[index] = slot
+        self._occupied[index] = 1
+        self._mark_taken(SPOT_TYPE_BY_CODE[self._types[index]])
+
+    def _release(self, index: int):
+        if not self._occupied[index]:
+            return
+        slot = self._vehicle_slot[index]
+        self._vehicles[slot] = None
+        self._free_slots.append(slot)
+        self._vehicle_slot[index] = -1
+        self._occupied[index] = 0
+        self._mark_freed(SPOT_TYPE_BY_CODE[self._types[index]], index)
+
+    def get_available_spots(self):
+        # Skips occupied rows without building a view for them
+        return [
+            CompactSpot(self, i)
+            for i, code in enumerate(self._types)
+            if code and not self._occupied[i]
+        ]
+
 
 import uuid
 from datetime import datetime
 
 
 class Ticket:
-    def __init__(self, vehicle: Vehicle, spot: ParkingSpot):
-        self.ticket_id = str(uuid.uuid4())
+    __slots__ = ("ticket_id", "vehicle", "spot", "entry_time", "exit_time", "fee")
+
+    def __init__(
+        self, vehicle: Vehicle, spot: ParkingSpot, ticket_id: str = None, entry_time=None
+    ):
+        # ticket_id/entry_time are only passed when a ticket is restored from a TicketStore
+        self.ticket_id = ticket_id or str(uuid.uuid4())
         self.vehicle = vehicle
         self.spot = spot
-        self.entry_time = datetime.now()
+        self.entry_time = entry_time or datetime.now()
+        self.exit_time = None  # set on leave
+        self.fee = None  # set on leave when the lot has a TariffEngine
+
+
+# ---------------------------------------------------------------------------------------------------
+# Durable ticket store: an append-only log (one JSON line per park/leave) plus periodic
+# snapshots of the open tickets. Writes are group-committed: lines are buffered and one
+# write + fsync covers the whole buffer, either when it fills up or every
+# group_commit_interval seconds from a background thread; a gate only writes itself once
+# the thread falls BUFFER_LIMIT_BATCHES batches behind. append() does not wait for the
+# fsync, so park_vehicle/leave hand out tickets whose records are not durable yet: a crash
+# loses the tickets of the last group_commit_interval (call flush() to wait for it), but
+# never leaves a torn or reordered log. Snapshots are taken by the same background thread.
+
+BUFFER_LIMIT_BATCHES = 16
+
+
+class TicketStore:
+    def __init__(
+        self,
+        directory: str,
+        group_commit_size: int = 1024,
+        group_commit_interval: float = 0.05,
+        snapshot_every: int = 200_000,
+    ):
+        os.makedirs(directory, exist_ok=True)
+        self.snapshot_path = os.path.join(directory, "tickets.snapshot")
+        self.log_path = os.path.join(directory, "tickets.wal")
+        self.old_log_path = self.log_path + ".old"  # the log before a snapshot in progress
+        self.group_commit_size = group_commit_size
+        self.group_commit_interval = group_commit_interval
+        self.snapshot_every = snapshot_every  # log records between snapshots
+        self._lock = threading.RLock()  # buffer and counters; never held across I/O
+        self._io_lock = threading.Lock()  # log writes, in buffer order
+        self._snapshot_lock = threading.Lock()  # one snapshot at a time
+        self._buffer = []
+        self._since_snapshot = 0
+        self._log = None  # opened by load()
+        self._lot = None  # the ParkingLot whose active_tickets get snapshotted
+        self._closed = threading.Event()
+        self._wake = threading.Event()  # a full group is waiting for the flusher
+        self._flusher = None
+        self._snapshotter = None
+
+    @staticmethod
+    def park_fields(ticket: "Ticket", level) -> list:
+        return [
+            "P",
+            ticket.ticket_id,
+            ticket.vehicle.license_plate,
+            ticket.vehicle.get_type().value,
+            level.level_num,
+            ticket.spot.spot_id,
+            ticket.entry_time.timestamp(),
+        ]
+
+    @staticmethod
+    def park_record(ticket: "Ticket", level) -> str:
+        return json.dumps(TicketStore.park_fields(ticket, level), separators=(",", ":")) + "\n"
+
+    @staticmethod
+    def leave_record(ticket_id: str) -> str:
+        return json.dumps(["L", ticket_id], separators=(",", ":")) + "\n"
+
+    @staticmethod
+    def _replay(path: str, tickets: dict) -> tuple:
+        # Apply one log to tickets -> (records replayed, byte offset past the last good one)
+        replayed = 0
+        good_end = 0
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # torn final write from a crash
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                good_end += len(line)
+                replayed += 1
+                if record[0] == "P":
+                    tickets[record[1]] = record
+                else:
+                    tickets.pop(record[1], None)
+        return replayed, good_end
+
+    def load(self) -> dict:
+        # Snapshot + log tail -> {ticket_id: park record}; then open the log for appends
+        tickets = {}
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path) as f:
+                for record in json.load(f):
+                    tickets[record[1]] = record
+        replayed = 0
+        interrupted = os.path.exists(self.old_log_path)  # crashed during a snapshot
+        if interrupted:
+            replayed += self._replay(self.old_log_path, tickets)[0]
+        if os.path.exists(self.log_path):
+            count, good_end = self._replay(self.log_path, tickets)
+            replayed += count
+            if good_end < os.path.getsize(self.log_path):
+                # Cut the torn tail off, or the next append would be glued onto it
+                with open(self.log_path, "r+b") as f:
+                    f.truncate(good_end)
+                    os.fsync(f.fileno())
+        if interrupted:
+            # Finish that snapshot from the recovered state, so the old log can go
+            self._write_snapshot(list(tickets.values()))
+            open(self.log_path, "w").close()
+            os.remove(self.old_log_path)
+            replayed = 0
+        self._since_snapshot = replayed
+        self._log = open(self.log_path, "a")
+        self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+        self._flusher.start()
+        return tickets
+
+    def attach(self, lot):
+        self._lot = lot
+
+    def append(self, records: list[str]):
+        with self._lock:
+            self._buffer.extend(records)
+            self._since_snapshot += len(records)
+            buffered = len(self._buffer)
+        if buffered >= BUFFER_LIMIT_BATCHES * self.group_commit_size:
+            self.flush()  # the flusher is stalled (slow disk); write it ourselves
+        elif buffered >= self.group_commit_size:
+            self._wake.set()
+
+    def _write_buffer(self):
+        # Call with _io_lock held: the buffer is swapped out under _lock, written outside it
+        with self._lock:
+            pending, self._buffer = self._buffer, []
+        if pending:
+            self._log.write("".join(pending))
+            self._log.flush()
+            os.fsync(self._log.fileno())
+
+    def flush(self):
+        with self._io_lock:
+            self._write_buffer()
+
+    def _flush_periodically(self):
+        while not self._closed.is_set():
+            self._wake.wait(self.group_commit_interval)
+            self._wake.clear()
+            self.flush()
+            due = self._since_snapshot >= self.snapshot_every
+            if due and (self._snapshotter is None or not self._snapshotter.is_alive()):
+                # On its own thread, so group commits keep going while it is written
+                self._snapshotter = threading.Thread(target=self.snapshot, daemon=True)
+                self._snapshotter.start()
+
+    def snapshot(self):
+        # Write every open ticket to a new snapshot. Only copying active_tickets happens
+        # under _lock; switching to a fresh log, encoding and fsyncing run outside it, so
+        # gates keep parking meanwhile. Until the snapshot is in place the records from
+        # before the switch stay in the old log. Replay is idempotent, so a park/leave
+        # racing with the copy is safe in either file.
+        with self._snapshot_lock:
+            with self._io_lock:
+                self._write_buffer()
+                with self._lock:
+                    open_tickets = list(self._lot.active_tickets.values()) if self._lot else []
+                    self._since_snapshot = 0
+                self._log.close()
+                os.replace(self.log_path, self.old_log_path)
+                self._log = open(self.log_path, "a")
+            self._write_snapshot([self.park_fields(ticket, level) for ticket, level in open_tickets])
+            os.remove(self.old_log_path)
+
+    def _write_snapshot(self, records: list):
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(records, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+
+    def close(self):
+        self._closed.set()
+        self._wake.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        if self._snapshotter is not None:
+            self._snapshotter.join()
+        with self._io_lock:
+            if self._log is not None:
+                self._write_buffer()
+                self._log.close()
+                self._log = None
+
+
+# ---------------------------------------------------------------------------------------------------
+# Fees: per-VehicleType hourly rates, time-of-day bands (multipliers on the hourly rate)
+# and a cap per 24h stay. For each vehicle type the tariff is turned into a per-minute
+# price table over one day and its running total, so the cost of any stay is a couple of
+# table lookups: cost(entry, exit) = F(exit) - F(entry), with F(t) = whole days * price of
+# a day + running total up to t's minute of the day. The same lookups vectorise with NumPy.
+
+WALL_EPOCH = datetime(1970, 1, 1)
+SECONDS_PER_DAY = 86_400
+
+
+def wall_seconds(moment: datetime) -> float:
+    # Seconds since 1970-01-01 on the wall clock, so "% 86400" gives the time of day
+    return (moment.replace(tzinfo=None) - WALL_EPOCH).total_seconds()
+
+
+class TariffEngine:
+    def __init__(
+        self,
+        hourly_rates: dict,
+        daily_caps: dict = None,
+        bands: list = (),
+    ):
+        # hourly_rates: {VehicleType: rate}; daily_caps: {VehicleType: max fee per 24h};
+        # bands: [(start_hour, end_hour, multiplier)], hours 0-24 (fractions to the minute),
+        # end exclusive, may wrap midnight; end 24 means "until midnight" and start == end
+        # covers the whole day
+        self.hourly_rates = hourly_rates
+        self.daily_caps = daily_caps or {}
+        self.bands = list(bands)
+        minute_multiplier = [1.0] * 1440
+        for start_hour, end_hour, multiplier in self.bands:
+            if not (0 <= start_hour <= 24 and 0 <= end_hour <= 24):
+                raise ValueError(f"Band hours must be in 0..24, got ({start_hour}, {end_hour})")
+            start, end = int(start_hour * 60), int(end_hour * 60)  # (7.5, 9) is 07:30-09:00
+            for step in range((end - start) % 1440 or 1440):
+                minute_multiplier[(start + step) % 1440] = multiplier
+        self._per_minute = {}  # VehicleType -> price of each minute of the day
+        self._running = {}  # VehicleType -> running total, 1441 entries
+        for vehicle_type in VehicleType:
+            rate = hourly_rates.get(vehicle_type, 0.0) / 60
+            per_minute = [rate * m for m in minute_multiplier]
+            running = [0.0]
+            for price in per_minute:
+                running.append(running[-1] + price)
+            self._per_minute[vehicle_type] = per_minute
+            self._running[vehicle_type] = running
+        self._tables = None  # NumPy copies, built on the first price_batch call
+
+    def _cost_until(self, vehicle_type: VehicleType, t: float) -> float:
+        days, second = divmod(t, SECONDS_PER_DAY)
+        minute, within = divmod(second, 60)
+        minute = int(minute)
+        running = self._running[vehicle_type]
+        return (
+            days * running[1440]
+            + running[minute]
+            + within / 60 * self._per_minute[vehicle_type][minute]
+        )
+
+    def price_seconds(self, vehicle_type: VehicleType, entry: float, exit: float) -> float:
+        # entry/exit are wall_seconds(); each started 24h window is capped separately
+        cap = self.daily_caps.get(vehicle_type, float("inf"))
+        full_days = int((exit - entry) // SECONDS_PER_DAY)
+        day_price = min(self._running[vehicle_type][1440], cap)
+        tail_start = entry + full_days * SECONDS_PER_DAY
+        tail = self._cost_until(vehicle_type, exit) - self._cost_until(vehicle_type, tail_start)
+        return round(full_days * day_price + min(tail, cap), 2)
+
+    def price(self, vehicle_type: VehicleType, entry_time: datetime, exit_time: datetime) -> float:
+        return self.price_seconds(vehicle_type, wall_seconds(entry_time), wall_seconds(exit_time))
+
+    def price_ticket(self, ticket: "Ticket") -> float:
+        return self.price(ticket.vehicle.get_type(), ticket.entry_time, ticket.exit_time)
+
+    def price_batch(self, vehicle_types, entry_seconds, exit_seconds):
+        # Reprices many stays at once. vehicle_types holds VehicleType.value codes;
+        # entry/exit are wall_seconds() values or datetime64 arrays. Returns an array of
+        # fees with NumPy, else a list (same numbers, one stay at a time).
+        if np is None:
+            return [
+                self.price_seconds(VehicleType(code), entry, exit)
+                for code, entry, exit in zip(vehicle_types, entry_seconds, exit_seconds)
+            ]
+        if self._tables is None:
+            codes = max(t.value for t in VehicleType) + 1
+            per_minute = np.zeros((codes, 1440))
+            running = np.zeros((codes, 1441))
+            caps = np.full(codes, np.inf)
+            for vehicle_type in VehicleType:
+                per_minute[vehicle_type.value] = self._per_minute[vehicle_type]
+                running[vehicle_type.value] = self._running[vehicle_type]
+                caps[vehicle_type.value] = self.daily_caps.get(vehicle_type, np.inf)
+            self._tables = (per_minute, running, caps)
+        per_minute, running, caps = self._tables
+        codes = np.asarray(vehicle_types, dtype=np.int64)
+        entry = self._as_seconds(entry_seconds)
+        exit = self._as_seconds(exit_seconds)
+
+        def cost_until(t):
+            days, second = np.divmod(t, SECONDS_PER_DAY)
+            minute, within = np.divmod(second, 60)
+            minute = minute.astype(np.int64)
+            return (
+                days * running[codes, 1440]
+                + running[codes, minute]
+                + within / 60 * per_minute[codes, minute]
+            )
+
+        cap = caps[codes]
+        full_days = np.floor_divide(exit - entry, SECONDS_PER_DAY)
+        day_price = np.minimum(running[codes, 1440], cap)
+        tail = cost_until(exit) - cost_until(entry + full_days * SECONDS_PER_DAY)
+        return np.round(full_days * day_price + np.minimum(tail, cap), 2)
+
+    @staticmethod
+    def _as_seconds(values):
+        values = np.asarray(values)
+        if values.dtype.kind == "M":  # datetime64
+            return values.astype("datetime64[us]").astype(np.int64) / 1e6
+        return values.astype(np.float64)
+
+    def reprice_tickets(self, tickets: list["Ticket"]):
+        # End-of-day audit: price every closed ticket in one batch
+        closed = [t for t in tickets if t.exit_time is not None]
+        return self.price_batch(
+            [t.vehicle.get_type().value for t in closed],
+            [wall_seconds(t.entry_time) for t in closed],
+            [wall_seconds(t.exit_time) for t in closed],
+        )
+
+
+# ---------------------------------------------------------------------------------------------------
+# Event stream: every park/leave becomes a small ParkingEvent in a bounded ring buffer, so
+# dashboards follow occupancy without polling. Emitting is an append plus a counter update;
+# async subscribers are only woken (call_soon_threadsafe) when some are actually waiting.
+
+
+class ParkingEvent:
+    __slots__ = ("seq", "kind", "timestamp", "level_num", "spot_id", "license_plate", "ticket_id")
+
+    PARK = "park"
+    LEAVE = "leave"
+
+    def __init__(self, seq, kind, timestamp, level_num, spot_id, license_plate, ticket_id):
+        self.seq = seq
+        self.kind = kind
+        self.timestamp = timestamp
+        self.level_num = level_num
+        self.spot_id = spot_id
+        self.license_plate = license_plate
+        self.ticket_id = ticket_id
+
+    def __repr__(self):
+        return f"ParkingEvent(#{self.seq} {self.kind} L{self.level_num} {self.spot_id})"
+
+
+class OccupancySeries:
+    # Down-sampled occupancy per level: one [bucket_start, min, max, last] row per
+    # interval seconds, keeping the most recent `history` rows of each level
+    def __init__(self, interval: float = 60.0, history: int = 1440):
+        self.interval = interval
+        self.history = history
+        self._rows = {}  # level_num -> deque of rows
+
+    def record(self, level_num: int, occupied: int, timestamp: float):
+        bucket = timestamp - timestamp % self.interval
+        rows = self._rows.get(level_num)
+        if rows is None:
+            rows = self._rows[level_num] = deque(maxlen=self.history)
+        if rows and rows[-1][0] == bucket:
+            row = rows[-1]
+            if occupied < row[1]:
+                row[1] = occupied
+            elif occupied > row[2]:
+                row[2] = occupied
+            row[3] = occupied
+        else:
+            rows.append([bucket, occupied, occupied, occupied])
+
+    def series(self, level_num: int) -> list:
+        return [tuple(row) for row in self._rows.get(level_num, ())]
+
+
+class EventStream:
+    def __init__(self, capacity: int = 65_536, sample_interval: float = 60.0, history: int = 1440):
+        self._events = deque(maxlen=capacity)
+        self._lock = threading.Lock()  # keeps seq order == buffer order across gates
+        self.next_seq = 0
+        self.occupancy = OccupancySeries(sample_interval, history)
+        self._occupied = {}  # level_num -> occupied spots, seeded by attach()
+        self._waiters = []  # (loop, asyncio.Event) of subscribers waiting for news
+
+    def attach(self, lot):
+        for level in lot.levels:
+            self._occupied[level.level_num] = len(level.spots) - level.get_available_count()
+
+    def emit(self, kind: str, level_num: int, spot_id: str, license_plate: str, ticket_id: str):
+        now = time.time()
+        with self._lock:
+            seq = self.next_seq
+            self.next_seq = seq + 1
+            self._events.append(
+                ParkingEvent(seq, kind, now, level_num, spot_id, license_plate, ticket_id)
+            )
+            occupied = self._occupied.get(level_num, 0) + (1 if kind == ParkingEvent.PARK else -1)
+            self._occupied[level_num] = occupied
+            self.occupancy.record(level_num, occupied, now)
+        if self._waiters:
+            self._wake()
+
+    def _wake(self):
+        with self._lock:
+            waiters, self._waiters = self._waiters, []
+        for loop, event in waiters:
+            # A subscriber must never break park/leave: skip loops that have gone away
+            if loop.is_closed():
+                continue
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:  # closed between the check and the call
+                pass
+
+    def since(self, seq: int) -> list[ParkingEvent]:
+        # Events with seq >= seq still in the buffer (older ones have been overwritten)
+        with self._lock:
+            if not self._events:
+                return []
+            start = max(0, seq - self._events[0].seq)
+            return list(islice(self._events, start, None))
+
+    async def subscribe(self, from_seq: int = None):
+        # async for event in stream.subscribe(): ... ; a gap in seq means the subscriber
+        # fell more than `capacity` events behind
+        loop = asyncio.get_running_loop()
+        seq = self.next_seq if from_seq is None else from_seq
+        while True:
+            events = self.since(seq)
+            if not events:
+                wake = asyncio.Event()
+                waiter = (loop, wake)
+                with self._lock:
+                    self._waiters.append(waiter)
+                try:
+                    events = self.since(seq)  # an emit may have slipped in before registering
+                    if not events:
+                        await wake.wait()
+                        continue
+                finally:
+                    # Cancelled (or woken by since()): don't leave the entry behind
+                    with self._lock:
+                        if waiter in self._waiters:
+                            self._waiters.remove(waiter)
+            for event in events:
+                seq = event.seq + 1
+                yield event
+
+
+# ---------------------------------------------------------------------------------------------------
+# Reservations: a driver books a SpotType on a level for a time window. Each
+# (level, SpotType) has a calendar of fixed-size time slots stored in a segment tree
+# (range add, range max), so "is there capacity between t1 and t2" and booking are both
+# O(log slots). The calendar is a ring: slots that have passed are cleared and reused
+# for the far end of the horizon, so the bookable window rolls forward with time.
+# Shortly before a booking starts (guard_minutes) walk-ins must leave one free spot of
+# its type alone; when the window opens (minus a lead time) the book holds a concrete
+# spot with a placeholder vehicle, so every allocation strategy simply sees it as taken;
+# when the driver arrives, the lot swaps the placeholder for the real vehicle.
+
+
+class SlotCalendar:
+    # Segment tree over time slots: add v to a slot range, max over a slot range
+    def __init__(self, num_slots: int):
+        self.size = num_slots
+        self._max = array("i", [0]) * (4 * num_slots)
+        self._add = array("i", [0]) * (4 * num_slots)
+
+    def add(self, lo: int, hi: int, value: int, node=1, node_lo=0, node_hi=None):
+        node_hi = self.size if node_hi is None else node_hi
+        if hi <= node_lo or node_hi <= lo:
+            return
+        if lo <= node_lo and node_hi <= hi:
+            self._add[node] += value
+            self._max[node] += value
+            return
+        mid = (node_lo + node_hi) // 2
+        self.add(lo, hi, value, 2 * node, node_lo, mid)
+        self.add(lo, hi, value, 2 * node + 1, mid, node_hi)
+        self._max[node] = max(self._max[2 * node], self._max[2 * node + 1]) + self._add[node]
+
+    def max(self, lo: int, hi: int, node=1, node_lo=0, node_hi=None) -> int:
+        node_hi = self.size if node_hi is None else node_hi
+        if hi <= node_lo or node_hi <= lo:
+            return -math.inf  # outside the range: must not win against negative slots
+        if lo <= node_lo and node_hi <= hi:
+            return self._max[node]
+        mid = (node_lo + node_hi) // 2
+        return self._add[node] + max(
+            self.max(lo, hi, 2 * node, node_lo, mid),
+            self.max(lo, hi, 2 * node + 1, mid, node_hi),
+        )
+
+    def clear(self, lo: int, hi: int):
+        # Zero every slot in [lo, hi), ready for reuse
+        for slot in range(lo, hi):
+            value = self.max(slot, slot + 1)
+            if value:
+                self.add(slot, slot + 1, -value)
+
+
+class ReservationHold(Vehicle):
+    # Placeholder parked in a reserved spot until its driver arrives
+    __slots__ = ("vehicle_type",)
+
+    HOLD_TYPE = {
+        SpotType.MOTORCYCLE: VehicleType.MOTORCYCLE,
+        SpotType.COMPACT: VehicleType.CAR,
+        SpotType.LARGE: VehicleType.TRUCK,
+    }
+
+    def __init__(self, reservation_id: str, spot_type: SpotType):
+        super().__init__(self.plate(reservation_id))
+        self.vehicle_type = self.HOLD_TYPE[spot_type]
+
+    @staticmethod
+    def plate(reservation_id: str) -> str:
+        return f"RESERVED:{reservation_id}"
+
+    def get_type(self):
+        return self.vehicle_type
+
+
+class Reservation:
+    __slots__ = (
+        "reservation_id", "level_num", "spot_type", "start", "end", "license_plate", "status", "spot",
+        "guarded",
+    )
+
+    PENDING = "pending"  # booked, window not open yet
+    HELD = "held"  # a spot is being held for the driver
+    PARKED = "parked"  # the driver arrived and took the held spot
+    UNFULFILLED = "unfulfilled"  # walk-ins had filled the level before the hold started
+    EXPIRED = "expired"  # window ended without the driver
+    CANCELLED = "cancelled"
+
+    def __init__(self, level_num, spot_type, start, end, license_plate):
+        self.reservation_id = str(uuid.uuid4())
+        self.level_num = level_num
+        self.spot_type = spot_type
+        self.start = start
+        self.end = end
+        self.license_plate = license_plate
+        self.status = Reservation.PENDING
+        self.spot = None
+        self.guarded = False  # a free spot is being kept back from walk-ins for it
+
+
+class ReservationBook:
+    def __init__(
+        self,
+        origin: datetime = None,
+        slot_minutes: int = 15,
+        horizon_days: int = 30,
+        hold_lead_minutes: int = 15,
+        guard_minutes: int = 240,
+    ):
+        # Bookable window: [now, now + horizon_days), in slot_minutes slots. Slots are
+        # numbered from origin; slot n lives at position n % num_slots of the calendars.
+        self.slot_seconds = slot_minutes * 60
+        origin_s = wall_seconds(origin or datetime.now())
+        self.origin_s = origin_s - origin_s % self.slot_seconds
+        self.num_slots = horizon_days * 24 * 3600 // self.slot_seconds
+        self.hold_lead_seconds = hold_lead_minutes * 60
+        self.guard_seconds = guard_minutes * 60
+        self._base = 0  # first slot still bookable (the current one)
+        self.reservations = {}
+        self._lot = None
+        self._levels = {}  # level_num -> level
+        self._calendars = {}  # (level_num, SpotType) -> SlotCalendar, built on first use
+        self._to_guard = []  # heap of (guard time, reservation_id)
+        self._to_hold = []  # heap of (hold time, reservation_id)
+        self._to_expire = []  # heap of (end time, reservation_id) for held spots
+        self._held_by_plate = {}  # license_plate -> held Reservation
+        self._lock = threading.RLock()
+
+    def attach(self, lot):
+        self._lot = lot
+        for level in lot.levels:
+            self._levels[level.level_num] = level
+
+    def _capacity(self, level_num: int, spot_type: SpotType) -> int:
+        # Read from the level on every booking, so spots added or removed later count
+        level = self._levels.get(level_num)
+        return level.spot_counts[spot_type] if level is not None else 0
+
+    def _window(self, start: datetime, end: datetime):
+        # Slots [lo, hi) of a window, without the part already in the past (None if all of it)
+        lo = int((wall_seconds(start) - self.origin_s) // self.slot_seconds)
+        hi = -int(-(wall_seconds(end) - self.origin_s) // self.slot_seconds)  # ceil
+        if hi <= self._base:
+            return None
+        return max(lo, self._base), hi
+
+    def _slots(self, start: datetime, end: datetime):
+        window = self._window(start, end)
+        if start >= end or window is None or window[1] > self._base + self.num_slots:
+            raise ValueError("reservation window is outside the bookable horizon")
+        return window
+
+    def _positions(self, lo: int, hi: int):
+        # Slot range -> at most two position ranges of the ring
+        lo_pos, hi_pos = lo % self.num_slots, hi % self.num_slots or self.num_slots
+        if lo_pos < hi_pos:
+            return ((lo_pos, hi_pos),)
+        return ((lo_pos, self.num_slots), (0, hi_pos))
+
+    def _booked(self, calendar: SlotCalendar, lo: int, hi: int) -> int:
+        return max(calendar.max(a, b) for a, b in self._positions(lo, hi))
+
+    def _book(self, calendar: SlotCalendar, lo: int, hi: int, change: int):
+        for a, b in self._positions(lo, hi):
+            calendar.add(a, b, change)
+
+    def _advance(self, now_s: float):
+        # Move the horizon forward: slots before now are cleared for reuse
+        slot = int((now_s - self.origin_s) // self.slot_seconds)
+        if slot <= self._base:
+            return
+        stale = min(slot, self._base + self.num_slots)
+        for calendar in self._calendars.values():
+            for a, b in self._positions(self._base, stale):
+                calendar.clear(a, b)
+        self._base = slot
+
+    def _calendar(self, key) -> SlotCalendar:
+        calendar = self._calendars.get(key)
+        if calendar is None:
+            calendar = self._calendars[key] = SlotCalendar(self.num_slots)
+        return calendar
+
+    def is_available(
+        self, level_num: int, spot_type: SpotType, start: datetime, end: datetime, now: datetime = None
+    ) -> bool:
+        key = (level_num, spot_type)
+        with self._lock:
+            self._advance(wall_seconds(now or datetime.now()))
+            lo, hi = self._slots(start, end)
+            return self._booked(self._calendar(key), lo, hi) < self._capacity(level_num, spot_type)
+
+    def reserve(
+        self,
+        level_num: int,
+        spot_type: SpotType,
+        start: datetime,
+        end: datetime,
+        license_plate: str,
+        now: datetime = None,
+    ) -> Reservation:
+        # Returns the Reservation, or None if every spot of that type is booked at some
+        # point in the window
+        key = (level_num, spot_type)
+        now_s = wall_seconds(now or datetime.now())
+        with self._lock:
+            self._advance(now_s)
+            lo, hi = self._slots(start, end)
+            calendar = self._calendar(key)
+            if self._booked(calendar, lo, hi) >= self._capacity(level_num, spot_type):
+                return None
+            self._book(calendar, lo, hi, 1)
+            reservation = Reservation(level_num, spot_type, start, end, license_plate)
+            self.reservations[reservation.reservation_id] = reservation
+            start_s = wall_seconds(start)
+            if start_s - self.guard_seconds <= now_s:
+                self._set_guard(reservation, True)  # starts soon: guard right away
+            else:
+                heapq.heappush(self._to_guard, (start_s - self.guard_seconds, reservation.reservation_id))
+            heapq.heappush(self._to_hold, (start_s - self.hold_lead_seconds, reservation.reservation_id))
+            return reservation
+
+    def _set_guard(self, reservation: Reservation, guarded: bool):
+        if reservation.guarded != guarded:
+            reservation.guarded = guarded
+            level = self._levels[reservation.level_num]
+            level.keep_back(reservation.spot_type, 1 if guarded else -1)
+
+    def cancel(self, reservation_id: str) -> bool:
+        with self._lock:
+            reservation = self.reservations.get(reservation_id)
+            if reservation is None or reservation.status not in (Reservation.PENDING, Reservation.HELD):
+                return False
+            self._release(reservation, Reservation.CANCELLED)
+            return True
+
+    def _release(self, reservation: Reservation, status: str):
+        # Frees the calendar slots and, if held, the spot; stale heap entries are skipped
+        window = self._window(reservation.start, reservation.end)  # past slots are cleared
+        if window is not None:
+            self._book(self._calendar((reservation.level_num, reservation.spot_type)), *window, -1)
+        self._set_guard(reservation, False)
+        if reservation.status == Reservation.HELD:
+            self._held_by_plate.pop(reservation.license_plate, None)
+            reservation.spot.remove_vehicle()
+            self._lot._hold_changed(ParkingEvent.LEAVE, reservation)
+            reservation.spot = None
+        reservation.status = status
+
+    def activate_due(self, now: datetime = None):
+        # Start holds whose window (minus the lead) has opened and drop expired holds.
+        # Called on every park; usually just two heap peeks.
+        now = wall_seconds(now or datetime.now())
+        if not (
+            (self._to_guard and self._to_guard[0][0] <= now)
+            or (self._to_hold and self._to_hold[0][0] <= now)
+            or (self._to_expire and self._to_expire[0][0] <= now)
+            or now - self.origin_s >= (self._base + 1) * self.slot_seconds
+        ):
+            return
+        with self._lock:
+            self._advance(now)
+            while self._to_guard and self._to_guard[0][0] <= now:
+                _, reservation_id = heapq.heappop(self._to_guard)
+                reservation = self.reservations[reservation_id]
+                if reservation.status == Reservation.PENDING:
+                    self._set_guard(reservation, True)
+            while self._to_hold and self._to_hold[0][0] <= now:
+                _, reservation_id = heapq.heappop(self._to_hold)
+                reservation = self.reservations[reservation_id]
+                if reservation.status != Reservation.PENDING:
+                    continue
+                level = self._levels[reservation.level_num]
+                hold = ReservationHold(reservation_id, reservation.spot_type)
+                with level.lock:  # take the kept-back spot and stop guarding it in one step
+                    spot = level.park_vehicle(hold, (reservation.spot_type,), walk_in=False)
+                    self._set_guard(reservation, False)
+                if spot is None:
+                    reservation.status = Reservation.UNFULFILLED
+                    continue
+                reservation.status = Reservation.HELD
+                reservation.spot = spot
+                self._lot._hold_changed(ParkingEvent.PARK, reservation)
+                self._held_by_plate[reservation.license_plate] = reservation
+                heapq.heappush(self._to_expire, (wall_seconds(reservation.end), reservation_id))
+            while self._to_expire and self._to_expire[0][0] <= now:
+                _, reservation_id = heapq.heappop(self._to_expire)
+                reservation = self.reservations[reservation_id]
+                if reservation.status == Reservation.HELD:
+                    self._release(reservation, Reservation.EXPIRED)
+
+    def claim(self, vehicle: Vehicle):
+        # If this vehicle has a held spot it fits, hand it over: -> (level, spot) or None
+        if vehicle.license_plate not in self._held_by_plate:
+            return None
+        with self._lock:
+            reservation = self._held_by_plate.get(vehicle.license_plate)
+            if reservation is None or not reservation.spot.can_fit_vehicle(vehicle):
+                return None
+            level = self._levels[reservation.level_num]
+            spot = reservation.spot
+            with level.lock:  # swap placeholder -> vehicle without the spot looking free
+                spot.remove_vehicle()
+                spot.park_vehicle(vehicle)
+            # The hold leaves here; the lot emits the vehicle's park with its ticket
+            self._lot._hold_changed(ParkingEvent.LEAVE, reservation)
+            del self._held_by_plate[vehicle.license_plate]
+            reservation.status = Reservation.PARKED
+            return level, spot
+
+
+class BatchResult:
+    def __init__(self):
+        self.succeeded = []  # tickets for park_many, ticket ids for leave_many
+        self.failed = []  # (vehicle or ticket_id, reason)
+
+    def __repr__(self):
+        return f"BatchResult(succeeded={len(self.succeeded)}, failed={len(self.failed)})"
+
+
+# ---------------------------------------------------------------------------------------------------
+# Allocation strategies (Strategy Pattern, like 2.Design Pattern/2. strategy.py).
+# A strategy orders spots inside a level (spot_key, kept in the level's free heaps) and
+# ranks levels for a SpotType (level_key, kept in the lot-wide index). Both are heaps, so
+# every policy places a vehicle in O(log n).
+
+
+class AllocationStrategy(ABC):
+    # True: the smallest fitting SpotType with any capacity wins, then the best level
+    # for it. False: the best (level_key, SpotType) pair across all fitting types wins.
+    type_first = False
+
+    # spot_key(spot) -> comparable; None keeps insertion order within a level
+    spot_key = None
+
+    @abstractmethod
+    def level_key(self, level, spot_type: SpotType, level_pos: int):
+        # Only called for levels that have a free spot of spot_type; smaller is better
+        pass
+
+
+class FirstFitStrategy(AllocationStrategy):
+    # Walk the levels in order and take the smallest fitting spot on the first level
+    # that has one (the original behaviour)
+    def level_key(self, level, spot_type, level_pos):
+        return (level_pos,)
+
+
+class BestFitStrategy(AllocationStrategy):
+    # Smallest fitting spot anywhere in the lot, so motorcycles don't use up the
+    # LARGE spots trucks need; lowest level breaks ties
+    type_first = True
+
+    def level_key(self, level, spot_type, level_pos):
+        return (level_pos,)
+
+
+class NearestEntranceStrategy(AllocationStrategy):
+    # Nearest free fitting spot to the entrance, using precomputed distances
+    def __init__(self, distances: dict):
+        self.distances = distances  # spot_id -> distance from the entrance
+
+    def spot_key(self, spot):
+        return self.distances.get(spot.spot_id, float("inf"))
+
+    def level_key(self, level, spot_type, level_pos):
+        return (level.top_key(spot_type), level_pos)
+
+
+class LevelBalancingStrategy(AllocationStrategy):
+    # Smallest fitting SpotType, on whichever level has the most of it free
+    type_first = True
+
+    def level_key(self, level, spot_type, level_pos):
+        return (-level.free_counts[spot_type], level_pos)
+
+
+# park_many: a pick overtaken within this many lookups sends its SpotType back to the index
+VOLATILE_PICK_LOOKUPS = 4
 
 
 class ParkingLot:
-    def __init__(self, levels: list[Level]):
+    def __init__(
+        self,
+        levels: list[Level],
+        concurrent: bool = False,
+        verbose: bool = True,
+        strategy: AllocationStrategy = None,
+        store: TicketStore = None,
+        tariff: TariffEngine = None,
+        events: EventStream = None,
+        reservations: ReservationBook = None,
+    ):
         self.levels = levels
+        self.tariff = tariff
+        self.events = events
+        self.strategy = strategy or FirstFitStrategy()
         self.active_tickets = {}
+        self.verbose = verbose  # print a line per park/leave like the demo does
+        self._level_pos = {level: i for i, level in enumerate(levels)}
+        # Concurrent mode: one lock per level (spot claims, free heaps, counters) and a
+        # small lock around the lot-wide index. Lock order is always level -> index.
+        self.concurrent = concurrent
+        self._index_lock = threading.Lock() if concurrent else NO_LOCK
+        # Lot-wide index: per SpotType, a min-heap of (level_key, level_pos) for levels
+        # with a free spot of that type. Entries go stale when a level's key changes
+        # or it fills up and are dropped lazily; _pushed remembers the key each level
+        # currently has in the heap so unchanged keys are not pushed again.
+        self._levels_with_free = {spot_type: [] for spot_type in SpotType}
+        self._pushed = {spot_type: {} for spot_type in SpotType}
+        for level in levels:
+            level._lot = self
+            if concurrent:
+                level.lock = threading.RLock()
+            level.set_spot_key(self.strategy.spot_key)  # also indexes the level
+        self.store = store
+        if store is not None:
+            self._recover(store.load())
+            store.attach(self)
+        if events is not None:
+            events.attach(self)
+        self.reservations = reservations
+        if reservations is not None:
+            reservations.attach(self)
 
-    def park_vehicle(self, vehicle: Vehicle) -> Ticket:
-        for level in self.levels:  # levels is a list of object of levels
+    def _recover(self, records: dict):
+        # Re-occupy the spots of every open ticket; the normal spot hooks rebuild the
+        # free heaps, counters and lot-wide index as they go
+        levels_by_num = {level.level_num: level for level in self.levels}
+        for ticket_id, plate, vehicle_type, level_num, spot_id, entry_ts in (
+            record[1:] for record in records.values()
+        ):
+            level = levels_by_num.get(level_num)
+            spot = level.get_spot(spot_id) if level is not None else None
+            vehicle = VEHICLE_CLASSES[VehicleType(vehicle_type)](plate)
+            if spot is None or not spot.park_vehicle(vehicle):
+                continue  # the layout changed since the ticket was issued
+            ticket = Ticket(vehicle, spot, ticket_id, datetime.fromtimestamp(entry_ts))
+            self.active_tickets[ticket_id] = (ticket, level)
+
+    def _current_key(self, level_pos: int, spot_type: SpotType):
+        level = self.levels[level_pos]
+        if not level.has_free(spot_type):
+            return None
+        return self.strategy.level_key(level, spot_type, level_pos)
+
+    def _touch(self, level: Level, spot_type: SpotType):
+        # Called by a level (under its lock) whenever its free spots of a type change
+        level_pos = self._level_pos.get(level)
+        if level_pos is None:
+            return  # not fully registered yet; set_spot_key re-indexes it
+        with self._index_lock:
+            key = self._current_key(level_pos, spot_type)
+            pushed = self._pushed[spot_type]
+            if key is None or pushed.get(level_pos) == key:
+                return
+            heap = self._levels_with_free[spot_type]
+            heapq.heappush(heap, (key, level_pos))
+            pushed[level_pos] = key
+            if len(heap) > 4 * len(self.levels) + 16:
+                self._rebuild_index(spot_type)
+
+    def _rebuild_index(self, spot_type: SpotType):
+        # Drop accumulated stale entries (keys that change on every park/leave)
+        pushed = self._pushed[spot_type]
+        pushed.clear()
+        heap = []
+        for level_pos in range(len(self.levels)):
+            key = self._current_key(level_pos, spot_type)
+            if key is not None:
+                heap.append((key, level_pos))
+                pushed[level_pos] = key
+        heapq.heapify(heap)
+        self._levels_with_free[spot_type] = heap
+
+    def _best_level_for(self, spot_type: SpotType):
+        heap = self._levels_with_free[spot_type]
+        pushed = self._pushed[spot_type]
+        while heap:
+            key, level_pos = heap[0]
+            if self._current_key(level_pos, spot_type) == key:
+                return heap[0]
+            heapq.heappop(heap)  # stale: level filled up or its key moved
+            if pushed.get(level_pos) == key:
+                del pushed[level_pos]
+        return None
+
+    def _find_level(self, vehicle: Vehicle):
+        # Returns (level_pos, spot_type) chosen by the strategy, or None if full
+        best = None
+        with self._index_lock:
+            for rank, spot_type in enumerate(FITTING_SPOTS.get(vehicle.get_type(), ())):
+                top = self._best_level_for(spot_type)
+                if top is None:
+                    continue
+                if self.strategy.type_first:
+                    return top[1], spot_type
+                if best is None or (top[0], rank) < best[0]:
+                    best = ((top[0], rank), top[1], spot_type)
+        return (best[1], best[2]) if best else None
+
+    def _claim_spot(self, vehicle: Vehicle):
+        if self.reservations is not None:
+            self.reservations.activate_due()
+            held = self.reservations.claim(vehicle)
+            if held is not None:
+                return held
+        # Another gate may win the race for the chosen spot between the index lookup
+        # and the level lock; the level is then re-indexed, so just look again
+        while True:
+            found = self._find_level(vehicle)
+            if found is None:
+                return None, None
+            level = self.levels[found[0]]
             spot = level.park_vehicle(
-                vehicle
+                vehicle, (found[1],)
             )  # this will be calling level park_vechicle press F!2 to check
             if spot:
-                ticket = Ticket(vehicle, spot)  # Created a ticket here with id
-                self.active_tickets[ticket.ticket_id] = (ticket, level)
+                return level, spot
+
+    def park_vehicle(self, vehicle: Vehicle) -> Ticket:
+        level, spot = self._claim_spot(vehicle)
+        if spot:
+            ticket = Ticket(vehicle, spot)  # Created a ticket here with id
+            self.active_tickets[ticket.ticket_id] = (ticket, level)
+            if self.store is not None:
+                self.store.append([TicketStore.park_record(ticket, level)])
+            if self.events is not None:
+                self._emit(ParkingEvent.PARK, ticket, level)
+            if self.verbose:
                 print(f"Vehicle parked at Level {level.level_num}, Spot {spot.spot_id}")
-                return ticket
-        print("No available spot for this vehicle.")
+            return ticket
+        if self.verbose:
+            print("No available spot for this vehicle.")
         return None
 
-    def leave(self, ticket_id: str):
-        if ticket_id not in self.active_tickets:
-            print("Invalid Ticket")
-            return
-        ticket, level = self.active_tickets.pop(ticket_id)
-        level.free_spot(ticket.spot.spot_id)
-        print(
-            f"Vehicle with plate {ticket.vehicle.license_plate} left spot {ticket.spot.spot_id}."
+    def _emit(self, kind: str, ticket: Ticket, level: Level):
+        self.events.emit(
+            kind, level.level_num, ticket.spot.spot_id, ticket.vehicle.license_plate, ticket.ticket_id
         )
 
+    def _hold_changed(self, kind: str, reservation: Reservation):
+        # A ReservationBook took or gave back a spot: holds count as occupied on the stream
+        if self.events is not None:
+            self.events.emit(
+                kind,
+                reservation.level_num,
+                reservation.spot.spot_id,
+                ReservationHold.plate(reservation.reservation_id),
+                reservation.reservation_id,
+            )
+
+    def _close_ticket(self, ticket: Ticket):
+        ticket.exit_time = datetime.now()
+        if self.tariff is not None:
+            ticket.fee = self.tariff.price_ticket(ticket)
+
+    def leave(self, ticket_id: str) -> Ticket:
+        entry = self.active_tickets.pop(ticket_id, None)  # atomic, so one exit per ticket
+        if entry is None:
+            if self.verbose:
+                print("Invalid Ticket")
+            return None
+        ticket, level = entry
+        level.free_spot(ticket.spot.spot_id)  # re-indexes the level via _touch
+        self._close_ticket(ticket)
+        if self.store is not None:
+            self.store.append([TicketStore.leave_record(ticket_id)])
+        if self.events is not None:
+            self._emit(ParkingEvent.LEAVE, ticket, level)
+        if self.verbose:
+            fee = f" Fee: {ticket.fee:.2f}" if ticket.fee is not None else ""
+            print(
+                f"Vehicle with plate {ticket.vehicle.license_plate} left spot {ticket.spot.spot_id}.{fee}"
+            )
+        return ticket
+
+    def park_many(self, vehicles: list[Vehicle]) -> BatchResult:
+        # Vehicles with a held reservation claim it; the rest are placed in arrival order,
+        # each where park_vehicle would put it. The strategy's pick for each SpotType stays
+        # open across vehicles: its level is taken out of the lot-wide index and stops
+        # re-indexing itself, so a vehicle only compares the pick's live key with the
+        # runner-up's, and the level is re-indexed once when the runner-up overtakes it or
+        # the batch ends. Types whose pick is overtaken almost at once (keys that move on
+        # every park, like LevelBalancingStrategy's) go back to the index for the rest of
+        # the batch. Without printing; failures are reported in the result instead.
+        result = BatchResult()
+        placed = [None] * len(vehicles)  # (level, spot) per vehicle
+        picks = {}  # SpotType -> [level_pos, runner-up (key, level_pos) or None, lookups served]
+        volatile = set()  # SpotTypes looked up in the index instead
+        if self.reservations is not None:
+            self.reservations.activate_due()
+        try:
+            for i, vehicle in enumerate(vehicles):
+                held = self.reservations.claim(vehicle) if self.reservations is not None else None
+                if held is None:
+                    held = self._park_from_picks(vehicle, picks, volatile)
+                placed[i] = held
+        finally:
+            for spot_type, (level_pos, _, _) in picks.items():
+                self.levels[level_pos].resume_index(spot_type)
+        active = self.active_tickets
+        for vehicle, where in zip(vehicles, placed):
+            if where is None:
+                result.failed.append((vehicle, "no available spot"))
+                continue
+            level, spot = where
+            ticket = Ticket(vehicle, spot)
+            active[ticket.ticket_id] = (ticket, level)
+            result.succeeded.append(ticket)
+            if self.events is not None:
+                self._emit(ParkingEvent.PARK, ticket, level)
+        if self.store is not None and result.succeeded:
+            self.store.append(
+                [TicketStore.park_record(t, active[t.ticket_id][1]) for t in result.succeeded]
+            )
+        return result
+
+    def _park_from_picks(self, vehicle: Vehicle, picks: dict, volatile: set):
+        # _claim_spot for one vehicle, with the best level per SpotType read from picks
+        while True:
+            best = None
+            for rank, spot_type in enumerate(FITTING_SPOTS.get(vehicle.get_type(), ())):
+                if spot_type in volatile:
+                    with self._index_lock:
+                        top = self._best_level_for(spot_type)
+                else:
+                    top = self._pick(spot_type, picks, volatile)
+                if top is None:
+                    continue
+                if self.strategy.type_first:
+                    best = (None, top[1], spot_type)
+                    break
+                if best is None or (top[0], rank) < best[0]:
+                    best = ((top[0], rank), top[1], spot_type)
+            if best is None:
+                return None
+            level = self.levels[best[1]]
+            spot = level.park_vehicle(vehicle, (best[2],))
+            if spot:
+                return level, spot
+
+    def _pick(self, spot_type: SpotType, picks: dict, volatile: set):
+        # (key, level_pos) of the best level for spot_type, opening or moving its pick
+        pick = picks.get(spot_type)
+        if pick is not None:
+            level_pos, runner_up, served = pick
+            key = self._current_key(level_pos, spot_type)
+            if key is not None and (runner_up is None or (key, level_pos) < runner_up):
+                pick[2] = served + 1
+                return key, level_pos
+            del picks[spot_type]
+            self.levels[level_pos].resume_index(spot_type)
+            if served < VOLATILE_PICK_LOOKUPS:
+                volatile.add(spot_type)
+                with self._index_lock:
+                    return self._best_level_for(spot_type)
+        with self._index_lock:
+            top = self._best_level_for(spot_type)
+            if top is None:
+                return None
+            key, level_pos = top
+            heap = self._levels_with_free[spot_type]
+            while heap and heap[0] == top:  # the live top, plus any older copies
+                heapq.heappop(heap)
+            if self._pushed[spot_type].get(level_pos) == key:
+                del self._pushed[spot_type][level_pos]
+            runner_up = self._best_level_for(spot_type)
+        self.levels[level_pos].defer_index(spot_type)  # level lock, so outside the index lock
+        picks[spot_type] = [level_pos, runner_up, 1]
+        return top
+
+    def leave_many(self, ticket_ids: list[str]) -> BatchResult:
+        result = BatchResult()
+        by_level = {}
+        for ticket_id in ticket_ids:
+            entry = self.active_tickets.pop(ticket_id, None)
+            if entry is None:
+                result.failed.append((ticket_id, "invalid ticket"))
+                continue
+            by_level.setdefault(entry[1], []).append(entry[0])
+        # One lock acquisition per level for the whole batch of exits
+        for level, tickets in by_level.items():
+            with level.lock:
+                for ticket in tickets:
+                    level.free_spot(ticket.spot.spot_id)
+                    self._close_ticket(ticket)
+                    result.succeeded.append(ticket.ticket_id)
+                    if self.events is not None:
+                        self._emit(ParkingEvent.LEAVE, ticket, level)
+        if self.store is not None and result.succeeded:
+            self.store.append([TicketStore.leave_record(t) for t in result.succeeded])
+        return result
+
+    def availability(self) -> dict:
+        # Snapshot of the counters: {level_num: {SpotType: free}} in O(levels).
+        # Lock-free: each dict copy is atomic, so every level is self-consistent
+        # even while gates are parking (levels may be from slightly different moments)
+        return {level.level_num: dict(level.free_counts) for level in self.levels}
+
     def get_availability(self):
         for level in self.levels:
-            print(
-                f"Level {level.level_num} has {len(level.get_available_spots())} free spots."
+            print(f"Level {level.level_num} has {level.get_available_count()} free spots.")
+
+
+# ---------------------------------------------------------------------------------------------------
+# Many garages: a coordinator shards ParkingLots over worker processes (one lot lives in
+# exactly one process) and routes every call by garage id, so garages are served in
+# parallel on all cores instead of sharing one GIL. Only plain ids and ints cross the
+# process boundary.
+
+
+def _garage_worker(conn, garage_ids: list, lot_factory):
+    lots = {garage_id: lot_factory(garage_id) for garage_id in garage_ids}
+    for lot in lots.values():
+        lot.verbose = False
+    while True:
+        op, args = conn.recv()
+        if op == "stop":
+            conn.send(None)
+            return
+        if op == "park":
+            results = []
+            for garage_id, plate, vehicle_type in args:
+                lot = lots[garage_id]
+                ticket = lot.park_vehicle(VEHICLE_CLASSES[VehicleType(vehicle_type)](plate))
+                if ticket is None:
+                    results.append(None)
+                    continue
+                level = lot.active_tickets[ticket.ticket_id][1]
+                results.append((ticket.ticket_id, level.level_num, ticket.spot.spot_id))
+            conn.send(results)
+        elif op == "leave":
+            results = []
+            for garage_id, ticket_id in args:
+                ticket = lots[garage_id].leave(ticket_id)
+                results.append(None if ticket is None else (ticket.fee or 0.0))
+            conn.send(results)
+        elif op == "availability":
+            # {garage_id: {level_num: {SpotType.value: free}}}
+            conn.send(
+                {
+                    garage_id: {
+                        level_num: {t.value: n for t, n in counts.items()}
+                        for level_num, counts in lot.availability().items()
+                    }
+                    for garage_id, lot in lots.items()
+                }
+            )
+
+
+class GarageCoordinator:
+    def __init__(self, garages: dict, lot_factory, workers: int = None):
+        # garages: {garage_id: (x, y) location}; lot_factory(garage_id) -> ParkingLot and
+        # must be a module-level function so worker processes can use it
+        self.garages = garages
+        workers = max(1, min(workers or os.cpu_count() or 1, len(garages)))
+        garage_ids = list(garages)
+        self._shard_of = {gid: i % workers for i, gid in enumerate(garage_ids)}
+        self._conns = []
+        self._locks = []  # one request/response in flight per worker pipe
+        self._processes = []
+        for shard in range(workers):
+            parent_conn, child_conn = multiprocessing.Pipe()
+            owned = [gid for gid in garage_ids if self._shard_of[gid] == shard]
+            process = multiprocessing.Process(
+                target=_garage_worker, args=(child_conn, owned, lot_factory), daemon=True
             )
+            process.start()
+            self._conns.append(parent_conn)
+            self._locks.append(threading.Lock())
+            self._processes.append(process)
+
+    def _scatter(self, op: str, per_shard: dict) -> dict:
+        # Send to every shard first, then collect, so the shards work in parallel. Locks
+        # are taken in shard order so concurrent multi-shard calls cannot deadlock.
+        shards = sorted(per_shard)
+        sent = []
+        try:
+            for shard in shards:
+                self._locks[shard].acquire()
+                try:
+                    self._conns[shard].send((op, per_shard[shard]))
+                except BaseException:
+                    self._locks[shard].release()
+                    raise
+                sent.append(shard)
+        except BaseException:
+            # Drain the replies already requested so those pipes stay in step, then unlock
+            for shard in sent:
+                try:
+                    self._conns[shard].recv()
+                except Exception:
+                    pass
+                finally:
+                    self._locks[shard].release()
+            raise
+        results = {}
+        for shard in shards:
+            try:
+                results[shard] = self._conns[shard].recv()
+            finally:
+                self._locks[shard].release()
+        return results
+
+    def _route(self, op: str, calls: list) -> list:
+        # calls[i][0] is the garage id; results come back in the same order as calls
+        per_shard, positions = {}, {}
+        for i, call in enumerate(calls):
+            shard = self._shard_of[call[0]]
+            per_shard.setdefault(shard, []).append(call)
+            positions.setdefault(shard, []).append(i)
+        results = [None] * len(calls)
+        for shard, shard_results in self._scatter(op, per_shard).items():
+            for i, result in zip(positions[shard], shard_results):
+                results[i] = result
+        return results
+
+    def park(self, garage_id, vehicle: Vehicle):
+        # -> (ticket_id, level_num, spot_id), or None if the garage is full
+        return self.park_many([(garage_id, vehicle)])[0]
+
+    def park_many(self, arrivals: list) -> list:
+        # arrivals: [(garage_id, vehicle)]
+        return self._route(
+            "park",
+            [(gid, v.license_plate, v.get_type().value) for gid, v in arrivals],
+        )
+
+    def leave(self, garage_id, ticket_id: str):
+        # -> the fee (0.0 without a tariff), or None for an unknown ticket
+        return self.leave_many([(garage_id, ticket_id)])[0]
+
+    def leave_many(self, departures: list) -> list:
+        # departures: [(garage_id, ticket_id)]
+        return self._route("leave", departures)
+
+    def availability(self) -> dict:
+        # {garage_id: {SpotType: free}} across every garage in the city
+        merged = {}
+        every_shard = {shard: None for shard in range(len(self._conns))}
+        for shard_view in self._scatter("availability", every_shard).values():
+            for garage_id, levels in shard_view.items():
+                totals = {spot_type: 0 for spot_type in SpotType}
+                for counts in levels.values():
+                    for code, free in counts.items():
+                        totals[SPOT_TYPE_BY_CODE[code]] += free
+                merged[garage_id] = totals
+        return merged
+
+    def nearest_with(self, spot_type: SpotType, location: tuple):
+        # Nearest garage to location with a free spot_type spot, or None
+        best = None
+        for garage_id, totals in self.availability().items():
+            if totals[spot_type] > 0:
+                x, y = self.garages[garage_id]
+                distance = math.hypot(x - location[0], y - location[1])
+                if best is None or distance < best[0]:
+                    best = (distance, garage_id)
+        return best[1] if best else None
+
+    def close(self):
+        self._scatter("stop", {shard: None for shard in range(len(self._conns))})
+        for process in self._processes:
+            process.join()
 
 
 # ---------------------------------------------------------------------------------------------------
@@ -156,17 +1869,535 @@ def create_sample_parking_lot():
     return ParkingLot(levels)  # Create parking lot with leve;s
 
 
-# Test Code
-lot = create_sample_parking_lot()  # Created a parking lot with 2 levels 5 spots each
-v1 = Car("DL-123")
-v2 = Motorcycle("MH-456")
-v3 = Truck("UP-789")
+def large_level_spot_types(spots_per_level: int) -> list[SpotType]:
+    # 20% motorcycle, 60% compact, 20% large spots, interleaved
+    return [
+        SpotType.MOTORCYCLE if i % 10 < 2 else SpotType.COMPACT if i % 10 < 8 else SpotType.LARGE
+        for i in range(spots_per_level)
+    ]
+
+
+def create_large_parking_lot(
+    num_levels: int, spots_per_level: int, concurrent: bool = False, compact: bool = False
+) -> ParkingLot:
+    # Used by the benchmarks; compact=True builds CompactLevels instead of Levels
+    levels = []
+    spot_types = large_level_spot_types(spots_per_level)
+    for level_num in range(num_levels):
+        if compact:
+            levels.append(CompactLevel(level_num, spot_types))
+        else:
+            spots = [
+                ParkingSpot(f"L{level_num}-S{i}", spot_type)
+                for i, spot_type in enumerate(spot_types)
+            ]
+            levels.append(Level(level_num, spots))
+    return ParkingLot(levels, concurrent=concurrent, verbose=False)
+
+
+def random_vehicle(rng, n: int) -> Vehicle:
+    # 20% motorcycles, 65% cars, 15% trucks
+    r = rng.random()
+    if r < 0.2:
+        return Motorcycle(f"M-{n}")
+    if r < 0.85:
+        return Car(f"C-{n}")
+    return Truck(f"T-{n}")
+
+
+# ---------------------------------------------------------------------------------------------------
+# Load simulator: discrete-event simulation of a day at the garage. Arrivals are a Poisson
+# process, vehicle types follow a configurable mix and each vehicle stays for a sampled
+# dwell time. The simulator drives park_vehicle/leave on a real lot and measures them.
+
+
+def exponential_dwell(mean_minutes: float):
+    return lambda rng, vehicle_type: rng.expovariate(1 / (mean_minutes * 60))
+
+
+def lognormal_dwell(median_minutes: float, sigma: float = 0.8):
+    mu = math.log(median_minutes * 60)
+    return lambda rng, vehicle_type: rng.lognormvariate(mu, sigma)
+
+
+class SimulationReport:
+    def __init__(self, arrivals, rejected, departures, latencies_ns, wall_seconds, peak_bytes):
+        self.arrivals = arrivals
+        self.rejected = rejected
+        self.departures = departures
+        self.ops = len(latencies_ns)
+        latencies_ns.sort()
+        self.p50_us = latencies_ns[len(latencies_ns) // 2] / 1000 if latencies_ns else 0.0
+        self.p99_us = latencies_ns[int(len(latencies_ns) * 0.99)] / 1000 if latencies_ns else 0.0
+        self.ops_per_sec = self.ops / wall_seconds if wall_seconds else 0.0
+        self.peak_bytes = peak_bytes
+
+    def __str__(self):
+        memory = f", peak {self.peak_bytes / 2**20:.1f} MiB" if self.peak_bytes else ""
+        return (
+            f"{self.arrivals:,} arrivals ({self.rejected:,} turned away), "
+            f"{self.departures:,} departures | p50 {self.p50_us:.1f} us, "
+            f"p99 {self.p99_us:.1f} us, {self.ops_per_sec:,.0f} ops/sec{memory}"
+        )
+
+
+class ParkingSimulator:
+    def __init__(
+        self,
+        lot: ParkingLot,
+        arrivals_per_hour: float,
+        vehicle_mix: dict = None,
+        dwell=None,
+        seed: int = 0,
+    ):
+        self.lot = lot
+        self.arrivals_per_hour = arrivals_per_hour
+        self.vehicle_mix = vehicle_mix or {
+            VehicleType.MOTORCYCLE: 0.2,
+            VehicleType.CAR: 0.65,
+            VehicleType.TRUCK: 0.15,
+        }
+        self.dwell = dwell or lognormal_dwell(90)  # dwell(rng, vehicle_type) -> seconds
+        self.seed = seed
+
+    def run(self, hours: float, measure_memory: bool = False) -> SimulationReport:
+        rng = random.Random(self.seed)
+        types, weights = list(self.vehicle_mix), list(self.vehicle_mix.values())
+        rate = self.arrivals_per_hour / 3600
+        end = hours * 3600
+        events = [(rng.expovariate(rate), 0, None)]  # (sim time, seq, ticket_id or None)
+        seq = 1
+        arrivals = rejected = departures = 0
+        latencies = []
+        lot = self.lot
+        if measure_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        while events:
+            now, _, ticket_id = heapq.heappop(events)
+            if ticket_id is None:
+                if now > end:
+                    continue  # gates close; keep draining departures
+                vehicle_type = rng.choices(types, weights)[0]
+                vehicle = VEHICLE_CLASSES[vehicle_type](f"SIM-{seq}")
+                t0 = time.perf_counter_ns()
+                ticket = lot.park_vehicle(vehicle)
+                latencies.append(time.perf_counter_ns() - t0)
+                arrivals += 1
+                if ticket is None:
+                    rejected += 1
+                else:
+                    leave_at = now + self.dwell(rng, vehicle_type)
+                    heapq.heappush(events, (leave_at, seq, ticket.ticket_id))
+                heapq.heappush(events, (now + rng.expovariate(rate), seq + 1, None))
+                seq += 2
+            else:
+                t0 = time.perf_counter_ns()
+                lot.leave(ticket_id)
+                latencies.append(time.perf_counter_ns() - t0)
+                departures += 1
+        elapsed = time.perf_counter() - started
+        peak = 0
+        if measure_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        return SimulationReport(arrivals, rejected, departures, latencies, elapsed, peak)
+
+
+def benchmark_simulation(num_levels=20, spots_per_level=500, hours=12):
+    # Baseline: a 10k spot garage near its steady-state capacity, for both layouts.
+    # tracemalloc slows everything down, so memory comes from a second identical run.
+    for compact in (False, True):
+        reports = []
+        for measure_memory in (False, True):
+            lot = create_large_parking_lot(num_levels, spots_per_level, compact=compact)
+            simulator = ParkingSimulator(lot, arrivals_per_hour=4500, dwell=lognormal_dwell(90))
+            reports.append(simulator.run(hours, measure_memory=measure_memory))
+        reports[0].peak_bytes = reports[1].peak_bytes
+        print(f"{'CompactLevel' if compact else 'Level':12s} {reports[0]}")
+
+
+# ---------------------------------------------------------------------------------------------------
+# Stress benchmark: many gate threads parking and leaving on one concurrent lot
+
+
+def benchmark_concurrent_gates(
+    num_levels=10, spots_per_level=100, thread_counts=(1, 2, 4, 8), ops_per_thread=20000
+):
+    for threads in thread_counts:
+        lot = create_large_parking_lot(num_levels, spots_per_level, concurrent=True)
+        double_booked = []
+
+        def gate(seed):
+            rng = random.Random(seed)
+            mine = []
+            for n in range(ops_per_thread):
+                if mine and (rng.random() < 0.5 or len(mine) > 200):
+                    lot.leave(mine.pop(rng.randrange(len(mine))).ticket_id)
+                    continue
+                vehicle = random_vehicle(rng, n)
+                ticket = lot.park_vehicle(vehicle)
+                if ticket:
+                    if ticket.spot.vehicle is not vehicle:
+                        double_booked.append(ticket.spot.spot_id)
+                    mine.append(ticket)
+
+        workers = [threading.Thread(target=gate, args=(seed,)) for seed in range(threads)]
+        start = time.perf_counter()
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        elapsed = time.perf_counter() - start
+
+        # Invariants: no spot handed out twice, counters match the spots themselves
+        spot_ids = [ticket.spot.spot_id for ticket, _ in lot.active_tickets.values()]
+        assert not double_booked and len(spot_ids) == len(set(spot_ids)), "double booking"
+        for level in lot.levels:
+            for spot_type in SpotType:
+                actual = sum(
+                    1 for s in level.spots if s.spot_type == spot_type and not s.occupied
+                )
+                assert level.free_counts[spot_type] == actual, "free counter drifted"
+        total_ops = threads * ops_per_thread
+        print(
+            f"{threads:2d} threads: {total_ops / elapsed:10,.0f} ops/sec "
+            f"({len(spot_ids)} parked, no double booking)"
+        )
+
+
+# ---------------------------------------------------------------------------------------------------
+# Throughput benchmark: park_many/leave_many vs one call per vehicle
+
+
+def benchmark_batch(num_levels=20, spots_per_level=500, batch_size=500, rounds=20):
+    def run(label, park, leave, capture_output=False):
+        lot = create_large_parking_lot(num_levels, spots_per_level)
+        rng = random.Random(42)
+        out = io.StringIO() if capture_output else None
+        start = time.perf_counter()
+        with redirect_stdout(out) if out else nullcontext():
+            for r in range(rounds):
+                batch = [random_vehicle(rng, r * batch_size + n) for n in range(batch_size)]
+                tickets = park(lot, batch)
+                leave(lot, [t.ticket_id for t in tickets[: len(tickets) // 2]])
+        elapsed = time.perf_counter() - start
+        ops = rounds * batch_size * 1.5
+        print(f"{label:28s} {ops / elapsed:10,.0f} ops/sec")
+
+    def park_each(lot, batch):
+        return [t for t in (lot.park_vehicle(v) for v in batch) if t]
+
+    def leave_each(lot, ticket_ids):
+        for ticket_id in ticket_ids:
+            lot.leave(ticket_id)
+
+    def park_verbose(lot, batch):
+        lot.verbose = True
+        return park_each(lot, batch)
+
+    run("per-call (printing)", park_verbose, leave_each, capture_output=True)
+    run("per-call (quiet)", park_each, leave_each)
+    run(
+        "park_many/leave_many",
+        lambda lot, batch: lot.park_many(batch).succeeded,
+        lambda lot, ids: lot.leave_many(ids),
+    )
+
+
+# ---------------------------------------------------------------------------------------------------
+# Memory benchmark: bytes per spot for each storage layout
+
+
+def benchmark_memory(num_spots=100_000):
+    class DictSpot:  # the original ParkingSpot layout, with an instance __dict__
+        def __init__(self, spot_id, spot_type):
+            self.spot_id = spot_id
+            self.spot_type = spot_type
+            self.occupied = False
+            self.vehicle = None
+
+    spot_types = large_level_spot_types(num_spots)
+    layouts = [
+        ("spot objects with __dict__", lambda: [
+            DictSpot(f"L0-S{i}", t) for i, t in enumerate(spot_types)
+        ]),
+        ("spot objects with __slots__", lambda: [
+            ParkingSpot(f"L0-S{i}", t) for i, t in enumerate(spot_types)
+        ]),
+        ("Level (spots + indexes)", lambda: Level(0, [
+            ParkingSpot(f"L0-S{i}", t) for i, t in enumerate(spot_types)
+        ])),
+        ("CompactLevel", lambda: CompactLevel(0, spot_types)),
+    ]
+    for label, build in layouts:
+        tracemalloc.start()
+        built = build()
+        used, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del built
+        print(f"{label:30s} {used / num_spots:7.1f} bytes/spot")
+
+
+# ---------------------------------------------------------------------------------------------------
+# Simulation benchmark: utilisation and latency of each allocation strategy
+
+
+def benchmark_strategies(num_levels=10, spots_per_level=300, steps=60_000):
+    total_spots = num_levels * spots_per_level
+    # Entrance on level 0; every level further away adds a ramp
+    distances = {
+        f"L{level_num}-S{i}": level_num * 100 + i % 50
+        for level_num in range(num_levels)
+        for i in range(spots_per_level)
+    }
+    strategies = [
+        FirstFitStrategy(),
+        BestFitStrategy(),
+        NearestEntranceStrategy(distances),
+        LevelBalancingStrategy(),
+    ]
+    print(
+        f"{'strategy':26s} {'util':>6s} {'turned away':>12s} {'trucks away':>12s} "
+        f"{'avg dist':>9s} {'level spread':>13s} {'park us':>8s}"
+    )
+    for strategy in strategies:
+        lot = create_large_parking_lot(num_levels, spots_per_level)
+        lot = ParkingLot(lot.levels, verbose=False, strategy=strategy)
+        rng = random.Random(7)
+        parked = []
+        arrivals = rejected = trucks = trucks_rejected = 0
+        occupancy_sum = distance_sum = park_time = 0.0
+        for n in range(steps):
+            # Slightly more arrivals than exits so the lot runs near full
+            if parked and rng.random() < 0.45:
+                last = parked.pop(rng.randrange(len(parked)))
+                lot.leave(last.ticket_id)
+            else:
+                vehicle = random_vehicle(rng, n)
+                is_truck = vehicle.get_type() == VehicleType.TRUCK
+                start = time.perf_counter()
+                ticket = lot.park_vehicle(vehicle)
+                park_time += time.perf_counter() - start
+                arrivals += 1
+                trucks += is_truck
+                if ticket is None:
+                    rejected += 1
+                    trucks_rejected += is_truck
+                else:
+                    parked.append(ticket)
+                    distance_sum += distances[ticket.spot.spot_id]
+            occupancy_sum += len(parked)
+        counts = [level.get_available_count() for level in lot.levels]
+        print(
+            f"{type(strategy).__name__:26s} "
+            f"{occupancy_sum / steps / total_spots:6.1%} "
+            f"{rejected / arrivals:12.1%} {trucks_rejected / max(trucks, 1):12.1%} "
+            f"{distance_sum / max(arrivals - rejected, 1):9.1f} "
+            f"{(max(counts) - min(counts)) / spots_per_level:13.1%} "
+            f"{park_time / arrivals * 1e6:8.1f}"
+        )
+
+
+# ---------------------------------------------------------------------------------------------------
+# Persistence benchmark: park/leave rate with a TicketStore and recovery time on restart
+
+
+def benchmark_persistence(num_levels=20, spots_per_level=500, ops=100_000):
+    directory = tempfile.mkdtemp(prefix="parking-store-")
+    try:
+        for label, store in (
+            ("in-memory", None),
+            ("TicketStore", TicketStore(directory, snapshot_every=50_000)),
+        ):
+            levels = create_large_parking_lot(num_levels, spots_per_level).levels
+            lot = ParkingLot(levels, verbose=False, store=store)
+            rng = random.Random(11)
+            parked = []
+            slowest = 0.0
+            start = time.perf_counter()
+            for n in range(ops):
+                op_start = time.perf_counter()
+                if parked and rng.random() < 0.45:
+                    lot.leave(parked.pop(rng.randrange(len(parked))).ticket_id)
+                else:
+                    ticket = lot.park_vehicle(random_vehicle(rng, n))
+                    if ticket:
+                        parked.append(ticket)
+                slowest = max(slowest, time.perf_counter() - op_start)
+            if store is not None:
+                store.flush()
+            elapsed = time.perf_counter() - start
+            print(f"{label:12s} {ops / elapsed:10,.0f} park/leave ops/sec, slowest {slowest * 1000:.1f} ms")
+            if store is not None:
+                store.close()
+                expected = lot.availability()
+                start = time.perf_counter()
+                levels = create_large_parking_lot(num_levels, spots_per_level).levels
+                restored = ParkingLot(levels, verbose=False, store=TicketStore(directory))
+                elapsed = time.perf_counter() - start
+                assert restored.availability() == expected, "recovered state differs"
+                print(
+                    f"recovered {len(restored.active_tickets)} open tickets "
+                    f"(snapshot + log tail) in {elapsed * 1000:.0f} ms"
+                )
+                restored.store.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+# ---------------------------------------------------------------------------------------------------
+# Billing benchmark: single-exit pricing and end-of-day batch repricing
+
+
+def sample_tariff() -> TariffEngine:
+    return TariffEngine(
+        hourly_rates={VehicleType.MOTORCYCLE: 1.0, VehicleType.CAR: 2.5, VehicleType.TRUCK: 5.0},
+        daily_caps={VehicleType.MOTORCYCLE: 10.0, VehicleType.CAR: 25.0, VehicleType.TRUCK: 60.0},
+        bands=[(7, 10, 1.5), (16, 19, 1.5), (22, 6, 0.5)],  # rush hours, cheap nights
+    )
+
+
+def benchmark_tariff(num_tickets=2_000_000):
+    tariff = sample_tariff()
+    rng = random.Random(5)
+    day_start = wall_seconds(datetime(2024, 1, 15))
+    codes = [rng.choice((1, 2, 2, 2, 3)) for _ in range(num_tickets)]
+    entries = [day_start + rng.uniform(0, SECONDS_PER_DAY) for _ in range(num_tickets)]
+    exits = [e + rng.expovariate(1 / 7200) * (20 if rng.random() < 0.02 else 1) for e in entries]
+
+    sample = 100_000
+    start = time.perf_counter()
+    single = [
+        tariff.price_seconds(VehicleType(c), e, x)
+        for c, e, x in zip(codes[:sample], entries[:sample], exits[:sample])
+    ]
+    elapsed = time.perf_counter() - start
+    print(f"single exit:  {elapsed / sample * 1e6:6.2f} us per ticket")
+
+    if np is None:
+        print("batch: NumPy is not installed, price_batch falls back to the single path")
+        return
+    codes, entries, exits = np.array(codes), np.array(entries), np.array(exits)
+    start = time.perf_counter()
+    fees = tariff.price_batch(codes, entries, exits)
+    elapsed = time.perf_counter() - start
+    assert np.allclose(fees[:sample], single), "batch and single pricing disagree"
+    print(f"batch:        {num_tickets:,} tickets in {elapsed:.2f} s (total {fees.sum():,.2f})")
+
+
+# ---------------------------------------------------------------------------------------------------
+# Coordinator benchmark: city-wide park/leave throughput by number of worker processes
+
+
+def create_garage_lot(garage_id) -> ParkingLot:
+    return create_large_parking_lot(5, 200)
+
+
+def benchmark_coordinator(num_garages=32, batch_size=2000, rounds=10):
+    rng = random.Random(9)
+    garages = {f"G{i}": (rng.uniform(0, 10), rng.uniform(0, 10)) for i in range(num_garages)}
+    for workers in sorted({1, os.cpu_count() or 1}):
+        coordinator = GarageCoordinator(garages, create_garage_lot, workers=workers)
+        garage_ids = list(garages)
+        start = time.perf_counter()
+        for r in range(rounds):
+            arrivals = [
+                (rng.choice(garage_ids), random_vehicle(rng, r * batch_size + n))
+                for n in range(batch_size)
+            ]
+            parked = coordinator.park_many(arrivals)
+            departures = [
+                (gid, result[0])
+                for (gid, _), result in zip(arrivals, parked)
+                if result and rng.random() < 0.5
+            ]
+            coordinator.leave_many(departures)
+        elapsed = time.perf_counter() - start
+        nearest = coordinator.nearest_with(SpotType.LARGE, (5.0, 5.0))
+        coordinator.close()
+        print(
+            f"{workers:2d} worker processes: {rounds * batch_size * 1.5 / elapsed:10,.0f} ops/sec "
+            f"(nearest LARGE to the centre: {nearest})"
+        )
+
+
+# ---------------------------------------------------------------------------------------------------
+# Event benchmark: hot-path cost of emitting events, and an async subscriber following them
+
+
+def benchmark_events(num_levels=20, spots_per_level=500, ops=200_000):
+    per_op = {}
+    for label, events in (("no events", None), ("EventStream", EventStream())):
+        levels = create_large_parking_lot(num_levels, spots_per_level).levels
+        lot = ParkingLot(levels, verbose=False, events=events)
+        rng = random.Random(13)
+        parked = []
+        start = time.perf_counter()
+        for n in range(ops):
+            if parked and rng.random() < 0.45:
+                lot.leave(parked.pop(rng.randrange(len(parked))).ticket_id)
+            else:
+                ticket = lot.park_vehicle(random_vehicle(rng, n))
+                if ticket:
+                    parked.append(ticket)
+        per_op[label] = (time.perf_counter() - start) / ops * 1e6
+        print(f"{label:12s} {per_op[label]:6.2f} us per park/leave")
+    print(f"emit overhead: {per_op['EventStream'] - per_op['no events']:.2f} us per event")
+
+    async def follow():
+        stream = EventStream()
+        lot = ParkingLot(create_large_parking_lot(2, 50).levels, verbose=False, events=stream)
+        received = []
+
+        async def dashboard():
+            async for event in stream.subscribe(from_seq=0):
+                received.append(event)
+                if len(received) == 3:
+                    return
+
+        task = asyncio.create_task(dashboard())
+        await asyncio.sleep(0)
+        ticket = lot.park_vehicle(Car("DL-1"))
+        await asyncio.sleep(0)
+        lot.park_vehicle(Truck("UP-2"))
+        lot.leave(ticket.ticket_id)
+        await asyncio.wait_for(task, 1)
+        print("subscriber saw:", received)
+        print("level 0 occupancy rows:", stream.occupancy.series(0))
+
+    asyncio.run(follow())
+
+
+if __name__ == "__main__":
+    import sys
+
+    commands = {
+        "bench-concurrency": benchmark_concurrent_gates,
+        "simulate": benchmark_simulation,
+        "bench-events": benchmark_events,
+        "bench-coordinator": benchmark_coordinator,
+        "bench-tariff": benchmark_tariff,
+        "bench-persistence": benchmark_persistence,
+        "bench-strategies": benchmark_strategies,
+        "bench-memory": benchmark_memory,
+        "bench-batch": benchmark_batch,
+    }
+    if len(sys.argv) > 1 and sys.argv[1] in commands:
+        commands[sys.argv[1]]()
+        sys.exit()
+
+    # Test Code
+    lot = create_sample_parking_lot()  # Created a parking lot with 2 levels 5 spots each
+    v1 = Car("DL-123")
+    v2 = Motorcycle("MH-456")
+    v3 = Truck("UP-789")
 
-t1 = lot.park_vehicle(v1)
-t2 = lot.park_vehicle(v2)
-t3 = lot.park_vehicle(v3)
+    t1 = lot.park_vehicle(v1)
+    t2 = lot.park_vehicle(v2)
+    t3 = lot.park_vehicle(v3)
 
-lot.get_availability()
+    lot.get_availability()
 
-lot.leave(t2.ticket_id)
-lot.get_availability()
+    lot.leave(t2.ticket_id)
+    lot.get_availability()
@@ -1,11 +1,258 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 import uuid
-from collections import defaultdict
+import itertools
+import math
+import random
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from heapq import heappush, heapreplace, merge
+
+try:
+    import numpy as np  # optional: only StackOverflow.recompute_reputation uses it
+except ImportError:
+    np = None
+
+TOKEN_RE = re.compile(r"\w+")
+
+# BM25 ranking parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+TITLE_WEIGHT = 2  # a title word counts as this many body words
+SCORE_BOOST = 0.5  # weight of log(1 + votes) added to the text relevance
+# Questions a query may score up front (posted or voted on since a ranked list was built)
+# before that list is rebuilt: k*log n, at least this many
+UPFRONT_SCORING_MIN = 64
+
+# Hot ranking: (score + 2 * answers + 0.5 * comments) / (age in hours + 2) ** 1.5
+HOT_ANSWER_WEIGHT = 2
+HOT_COMMENT_WEIGHT = 0.5
+HOT_AGE_OFFSET_HOURS = 2
+HOT_GRAVITY = 1.5
+HOT_REFRESH = timedelta(minutes=5)  # how often ages are re-applied to every question
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+def term_frequencies(title, content):
+    # -> (BM25 term frequencies, document length) of a question; title words count
+    # TITLE_WEIGHT times. Words are interned so the indexes share one string per word.
+    title_tokens = tokenize(title)
+    tokens = title_tokens + tokenize(content)
+    term_freqs = Counter(map(sys.intern, tokens))
+    for token in title_tokens:
+        term_freqs[token] += TITLE_WEIGHT - 1
+    return term_freqs, len(tokens) + (TITLE_WEIGHT - 1) * len(title_tokens)
+
+
+def intersect_sorted(lists):
+    # AND of ascending id lists: walk the shortest one and binary-search the others,
+    # so the cost follows the posting list sizes, not the corpus size
+    if not lists:
+        return []
+    lists = sorted(lists, key=len)
+    result = []
+    starts = [0] * len(lists)
+    for item in lists[0]:
+        for i in range(1, len(lists)):
+            pos = bisect_left(lists[i], item, starts[i])
+            starts[i] = pos
+            if pos == len(lists[i]) or lists[i][pos] != item:
+                break
+        else:
+            result.append(item)
+    return result
+
+
+def iter_descending(items, before):
+    # Items of an ascending list that are < before, largest first
+    for i in range(bisect_left(items, before) - 1, -1, -1):
+        yield items[i]
+
+
+def iter_members_descending(items, lists):
+    # Those of items (a descending stream) found in every ascending list; each binary
+    # search is bounded by the previous hit, as the items only get smaller
+    ends = [len(members) for members in lists]
+    for item in items:
+        for i, members in enumerate(lists):
+            pos = bisect_left(members, item, 0, ends[i])
+            ends[i] = pos
+            if pos == len(members) or members[pos] != item:
+                break
+        else:
+            yield item
+
+
+def iter_intersect_descending(lists, before):
+    # Lazy AND of ascending id lists, largest id first: walk the shortest list down
+    lists = sorted(lists, key=len)
+    return iter_members_descending(iter_descending(lists[0], before), lists[1:])
+
+
+def iter_union_descending(lists, before):
+    # Lazy OR of ascending id lists, largest id first, without duplicates
+    last = None
+    for item in merge(*(iter_descending(items, before) for items in lists), reverse=True):
+        if item != last:
+            yield item
+            last = item
+
+
+def sorted_descending(items, chunk=4096):
+    # sorted(items, reverse=True), but in chunks merged lazily: a background rebuild
+    # then never holds the GIL for one long C-level sort while queries wait
+    if len(items) <= chunk:
+        return sorted(items, reverse=True)
+    runs = [sorted(items[i : i + chunk], reverse=True) for i in range(0, len(items), chunk)]
+    return list(merge(*runs, reverse=True))
+
+
+def union_sorted(lists):
+    # OR of ascending id lists, without duplicates
+    result = []
+    for item in merge(*lists):
+        if not result or result[-1] != item:
+            result.append(item)
+    return result
+
+
+class IndexableSkipList:
+    # Sorted container of unique keys: insert, remove, rank and index in O(log n), and the
+    # first n keys in O(n). Each link also stores its width (how many nodes it jumps over)
+    # so positions can be counted on the way down. The head only has as many levels as
+    # the tallest node, so small lists stay small.
+    MAX_LEVEL = 32
+
+    class _Node:
+        __slots__ = ("key", "next", "width")
+
+        def __init__(self, key, level):
+            self.key = key
+            self.next = [None] * level
+            self.width = [1] * level
+
+    def __init__(self, keys=()):
+        # Bulk build in O(n) after sorting: link each level left to right
+        self._head = head = self._Node(None, 1)
+        self._size = 0
+        last = [head]
+        last_positions = [0]
+        for position, key in enumerate(sorted(keys), 1):
+            node = self._Node(key, self._random_level())
+            while len(head.next) < len(node.next):
+                head.next.append(None)
+                head.width.append(1)
+                last.append(head)
+                last_positions.append(0)
+            for i in range(len(node.next)):
+                last[i].next[i] = node
+                last[i].width[i] = position - last_positions[i]
+                last[i] = node
+                last_positions[i] = position
+            self._size = position
+        for i in range(len(head.next)):
+            last[i].width[i] = self._size + 1 - last_positions[i]
+
+    @classmethod
+    def _random_level(cls):
+        level = 1
+        while level < cls.MAX_LEVEL and random.random() < 0.5:
+            level += 1
+        return level
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        node = self._head.next[0]
+        while node is not None:
+            yield node.key
+            node = node.next[0]
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("skip list index out of range")
+        node = self._head
+        remaining = index + 1
+        for level in reversed(range(len(node.next))):
+            while node.next[level] is not None and node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        return node.key
+
+    def _path(self, key):
+        # Last node before key on every level, and how far each of them is from the head
+        levels = len(self._head.next)
+        chain = [self._head] * levels
+        positions = [0] * levels
+        node, position = self._head, 0
+        for level in reversed(range(levels)):
+            following = node.next[level]
+            while following is not None and following.key < key:
+                position += node.width[level]
+                node = following
+                following = node.next[level]
+            chain[level] = node
+            positions[level] = position
+        return chain, positions
+
+    def insert(self, key):
+        chain, positions = self._path(key)
+        node = self._Node(key, self._random_level())
+        head = self._head
+        while len(head.next) < len(node.next):  # new top level: head links to the end
+            head.next.append(None)
+            head.width.append(self._size + 1)
+            chain.append(head)
+            positions.append(0)
+        for i in range(len(node.next)):
+            prev = chain[i]
+            skipped = positions[0] - positions[i]  # nodes between prev and the new node
+            node.next[i] = prev.next[i]
+            node.width[i] = prev.width[i] - skipped
+            prev.next[i] = node
+            prev.width[i] = skipped + 1
+        for i in range(len(node.next), len(chain)):
+            chain[i].width[i] += 1
+        self._size += 1
+
+    def remove(self, key):
+        chain, _ = self._path(key)
+        node = chain[0].next[0]
+        if node is None or node.key != key:
+            raise KeyError(key)
+        for i in range(len(node.next)):
+            chain[i].width[i] += node.width[i] - 1
+            chain[i].next[i] = node.next[i]
+        for i in range(len(node.next), len(chain)):
+            chain[i].width[i] -= 1
+        self._size -= 1
+
+    def rank(self, key):
+        # 0-based position of key
+        chain, positions = self._path(key)
+        node = chain[0].next[0]
+        if node is None or node.key != key:
+            raise KeyError(key)
+        return positions[0]
 
 
 class User:
+    _next_index = itertools.count()
+
     def __init__(self, username, email):
         self.id = uuid.uuid4()
+        self.index = next(User._next_index)  # small int key for per-post vote maps
         self.username = username
         self.email = email
         self.reputation = 0
@@ -21,6 +268,8 @@ class Tag:
 
 
 class Comment:
+    __slots__ = ("id", "content", "author", "timestamp")
+
     def __init__(self, content, author):
         self.id = uuid.uuid4()
         self.content = content
@@ -31,103 +280,797 @@ class Comment:
 class Vote:
     UPVOTE = 1
     DOWNVOTE = -1
+    RETRACT = 0  # withdraw an earlier vote
 
     def __init__(self, user, vote_type):
         self.user = user
         self.vote_type = vote_type
 
 
-class Answer:
-    def __init__(self, content, author, question):
+# Reputation the author gains per vote on their post: {post KIND: {vote type: points}}
+DEFAULT_REPUTATION_RULES = {
+    "question": {Vote.UPVOTE: 1, Vote.DOWNVOTE: -1},
+    "answer": {Vote.UPVOTE: 1, Vote.DOWNVOTE: -1},
+}
+
+
+class Post:
+    # Vote bookkeeping shared by questions and answers. Scores are running counters, and
+    # votes are kept as {user index: vote type} holding only current voters: voting again
+    # changes the vote (up -> down moves the score by -2), the same vote twice is a no-op
+    # and RETRACT removes the entry. Vote objects are only rebuilt for audits. Most posts
+    # never get a comment or a vote, so both containers are created on first use.
+    # The id/content/author/timestamp record is not slotted here: Question and Answer
+    # declare it, the Stored* views read it from a PostStore row instead.
+    __slots__ = ("_comments", "score", "upvotes", "downvotes", "_votes")
+
+    def _init_record(self, content, author):
         self.id = uuid.uuid4()
         self.content = content
         self.author = author
-        self.question = question
-        self.comments = []
-        self.votes = []
         self.timestamp = datetime.now()
 
+    def _init_state(self):
+        self._comments = None
+        self.score = 0
+        self.upvotes = 0
+        self.downvotes = 0
+        self._votes = None
+
+    @property
+    def comments(self):
+        # Read-only: add comments through add_comment
+        return self._comments or ()
+
     def add_comment(self, comment):
-        self.comments.append(comment)
+        if self._comments is None:
+            self._comments = [comment]
+        else:
+            self._comments.append(comment)
+
+    def add_vote(self, vote, reputation=None):
+        # Returns the change in score (0 if the user already voted this way). reputation
+        # maps vote type -> author points for this kind of post; default: the score change
+        previous = self.vote_of(vote.user)
+        delta = vote.vote_type - previous
+        if not delta:
+            return 0
+        self._count(previous, -1)
+        self._count(vote.vote_type, 1)
+        if vote.vote_type == Vote.RETRACT:
+            del self._votes[vote.user.index]
+        elif self._votes is None:
+            self._votes = {vote.user.index: vote.vote_type}
+        else:
+            self._votes[vote.user.index] = vote.vote_type
+        self.score += delta
+        if reputation is None:
+            self.author.reputation += delta
+        else:
+            self.author.reputation += reputation.get(vote.vote_type, 0) - reputation.get(previous, 0)
+        return delta
 
-    def add_vote(self, vote):
-        self.votes.append(vote)
-        self.author.reputation += vote.vote_type
+    def _count(self, vote_type, change):
+        if vote_type == Vote.UPVOTE:
+            self.upvotes += change
+        elif vote_type == Vote.DOWNVOTE:
+            self.downvotes += change
+
+    def vote_of(self, user):
+        return self._votes.get(user.index, 0) if self._votes else 0
 
     def get_score(self):
-        return sum(v.vote_type for v in self.votes)
+        return self.score
 
 
-class Question:
-    def __init__(self, title, content, author, tags=None):
-        self.id = uuid.uuid4()
-        self.title = title
-        self.content = content
-        self.author = author
-        self.answers = []
-        self.comments = []
+class AnswerBase(Post):
+    # Answer behaviour without the record slots (see Answer and StoredAnswer)
+    KIND = "answer"
+    __slots__ = ("question", "seq")
+
+    def _init_answer(self, question):
+        self._init_state()
+        self.question = question
+        self.seq = None  # position in question.answers
+
+    def add_vote(self, vote, reputation=None):
+        delta = super().add_vote(vote, reputation)
+        if delta:
+            self.question._rescore_answer(self, self.score - delta)
+        return delta
+
+
+class Answer(AnswerBase):
+    __slots__ = ("id", "content", "author", "timestamp")
+
+    def __init__(self, content, author, question):
+        self._init_record(content, author)
+        self._init_answer(question)
+
+
+class QuestionBase(Post):
+    # Question behaviour without the record slots (see Question and StoredQuestion)
+    KIND = "question"
+    __slots__ = ("answers", "_answers_by_score", "accepted_answer", "tags", "seq", "doc_len")
+
+    def _init_question(self, tags):
+        self._init_state()
+        self.answers = []  # in posting order
+        # Answers by score: keys (-score, answer seq), so ties keep posting order. Created
+        # with the first answer, as most questions never get one.
+        self._answers_by_score = None
+        self.accepted_answer = None
         self.tags = tags if tags else []
-        self.votes = []
-        self.timestamp = datetime.now()
+        self.seq = None  # position in StackOverflow.questions, used by the indexes
+        # BM25 length; set by StackOverflow, which keeps the term frequencies in its index
+        self.doc_len = 0
+
+    @property
+    def tokens(self):
+        # Lowercased words of title + body (recomputed; the indexes keep term frequencies)
+        return tokenize(self.title) + tokenize(self.content)
 
     def add_answer(self, answer):
+        answer.seq = len(self.answers)
         self.answers.append(answer)
+        if self._answers_by_score is None:
+            self._answers_by_score = IndexableSkipList()
+        self._answers_by_score.insert((-answer.score, answer.seq))
 
-    def add_comment(self, comment):
-        self.comments.append(comment)
+    def _rescore_answer(self, answer, old_score):
+        if answer.seq is None or self._answers_by_score is None:
+            return  # not posted through add_answer yet; its counters are enough
+        self._answers_by_score.remove((-old_score, answer.seq))
+        self._answers_by_score.insert((-answer.score, answer.seq))
 
-    def add_vote(self, vote):
-        self.votes.append(vote)
-        self.author.reputation += vote.vote_type
+    def accept_answer(self, answer):
+        # Pins answer above the others; None clears the accepted answer
+        if answer is not None and answer.question is not self:
+            raise ValueError("Answer belongs to a different question")
+        self.accepted_answer = answer
 
-    def get_score(self):
-        return sum(v.vote_type for v in self.votes)
+    def ordered_answers(self, limit=None):
+        # Accepted answer first, then by score (highest first); the first limit in O(limit)
+        accepted = self.accepted_answer
+        by_score = (self.answers[seq] for _, seq in self._answers_by_score or ())
+        ordered = itertools.chain(
+            () if accepted is None else (accepted,),
+            (answer for answer in by_score if answer is not accepted),
+        )
+        return list(itertools.islice(ordered, limit))
 
 
-class StackOverflow:
+class Question(QuestionBase):
+    __slots__ = ("id", "content", "author", "timestamp", "title")
+
+    def __init__(self, title, content, author, tags=None):
+        self._init_record(content, author)
+        self.title = title
+        self._init_question(tags)
+
+
+# ---------------------------------------------------------------------------------------------------
+# Compact storage for very large sites: instead of a uuid, a datetime and a str per post
+# and comment, a PostStore keeps them in columns (timestamps as epoch microseconds, authors
+# as User.index, all text in one UTF-8 arena) and the Stored* classes are thin views over
+# one row, so StackOverflow(store=PostStore()) works unchanged. A view's id is its row.
+# Views hold nothing but the row: each store makes its own view subclasses (store.views)
+# with the store as a class attribute.
+
+POST_KIND_CODES = {"question": 0, "answer": 1, "comment": 2}
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+
+class PostStore:
     def __init__(self):
+        self.users = {}  # User.index -> User; StackOverflow shares its own map
+        self._lock = threading.Lock()  # rows are appended column by column
+        self._kinds = bytearray()  # POST_KIND_CODES per row
+        self._timestamps = array("q")  # microseconds since EPOCH (naive local time)
+        self._authors = array("q")  # User.index
+        self._first_text = array("q")  # the row's first text slot: content, then title
+        self._text_ends = array("q")  # text slot i is arena[end of slot i - 1 : end of slot i]
+        self._arena = bytearray()
+        self.views = {
+            view.KIND: type(view.__name__, (view,), {"__slots__": (), "_store": self})
+            for view in (StoredComment, StoredAnswer, StoredQuestion)
+        }  # kind -> view class bound to this store
+
+    def __len__(self):
+        return len(self._kinds)
+
+    def add(self, kind, author, *texts):
+        with self._lock:
+            row = len(self._kinds)
+            self._kinds.append(POST_KIND_CODES[kind])
+            self._timestamps.append((datetime.now() - EPOCH) // MICROSECOND)
+            self._authors.append(author.index)
+            self._first_text.append(len(self._text_ends))
+            for text in texts:
+                self._arena += text.encode()
+                self._text_ends.append(len(self._arena))
+            return row
+
+    def text(self, row, part=0):
+        slot = self._first_text[row] + part
+        start = self._text_ends[slot - 1] if slot else 0
+        return self._arena[start : self._text_ends[slot]].decode()
+
+    def author(self, row):
+        return self.users[self._authors[row]]
+
+    def timestamp(self, row):
+        return EPOCH + self._timestamps[row] * MICROSECOND
+
+    def set_timestamp(self, row, value):
+        self._timestamps[row] = (value - EPOCH) // MICROSECOND
+
+    def nbytes(self):
+        columns = (self._kinds, self._timestamps, self._authors, self._first_text, self._text_ends, self._arena)
+        return sum(len(column) * (column.itemsize if isinstance(column, array) else 1) for column in columns)
+
+
+class StoredRecord:
+    # id/content/author/timestamp of a Stored* view, read from its PostStore row
+    __slots__ = ()
+
+    @property
+    def id(self):
+        return self._row
+
+    @property
+    def content(self):
+        return self._store.text(self._row)
+
+    @property
+    def author(self):
+        return self._store.author(self._row)
+
+    @property
+    def timestamp(self):
+        return self._store.timestamp(self._row)
+
+    @timestamp.setter
+    def timestamp(self, value):
+        self._store.set_timestamp(self._row, value)
+
+
+class StoredComment(StoredRecord):
+    KIND = "comment"
+    __slots__ = ("_row",)
+
+    def __init__(self, content, author):
+        self._row = self._store.add("comment", author, content)
+
+
+class StoredAnswer(StoredRecord, AnswerBase):
+    __slots__ = ("_row",)
+
+    def __init__(self, content, author, question):
+        self._row = self._store.add("answer", author, content)
+        self._init_answer(question)
+
+
+class StoredQuestion(StoredRecord, QuestionBase):
+    __slots__ = ("_row",)
+
+    def __init__(self, title, content, author, tags=None):
+        self._row = self._store.add("question", author, content, title)
+        self._init_question(tags)
+
+    @property
+    def title(self):
+        return self._store.text(self._row, 1)
+
+
+class StackOverflow:
+    # Thread-safe for writers: new users/questions take one write lock (they extend the
+    # shared indexes), votes/answers/comments take striped locks - one stripe for the
+    # post, then one for the author's reputation (always in that order). Readers never
+    # lock: every index is append-only, and a question is published before its seq is.
+    def __init__(self, lock_stripes=64, reputation_rules=None, store=None):
+        self.reputation_rules = reputation_rules or DEFAULT_REPUTATION_RULES
+        self.store = store  # optional PostStore: posts and comments become Stored* views
+        self._write_lock = threading.Lock()
+        self._post_locks = [threading.Lock() for _ in range(lock_stripes)]
+        self._user_locks = [threading.Lock() for _ in range(lock_stripes)]
         self.users = []
         self.questions = []
         self.tags = {}
+        self._users_by_name = {}  # username -> User
+        self._users_by_index = {}  # User.index -> User, to rebuild votes for audits
+        if store is not None:
+            store.users = self._users_by_index
+        self._questions_by_author = defaultdict(list)  # username -> ascending question seqs
+        self._keyword_index = defaultdict(list)  # token -> ascending question seqs
+        # token -> term frequency per entry of _keyword_index[token]; appended first, so
+        # a lock-free reader always finds the frequency of a posting it can see
+        self._keyword_tfs = defaultdict(lambda: array("I"))
+        self._tag_index = defaultdict(list)  # tag name -> ascending question seqs
+        # BM25 statistics. avgdl is frozen per epoch (refreshed after 1% corpus growth)
+        # so impact-ordered postings can be cached per term for the whole epoch. An epoch
+        # is (docs, avgdl, {token: (postings covered, [(impact, seq)] desc)}); the next one
+        # is built on a background thread, cached words re-ranked, and swapped in whole.
+        self._total_len = 0
+        self._bm25 = (0, 1.0, {})
+        # The vote boost is one more impact-ordered list: ([(boost, seq)] desc, sets of
+        # questions voted on since it was built). Those questions are scored up front;
+        # once there are more of them than a query should score that way, the list is
+        # rebuilt in the background while votes go to a fresh set.
+        self._voted_since_boosts = set()
+        self._boosts = ([], (self._voted_since_boosts,))
+        self._rebuild_lock = threading.Lock()
+        self._rebuilding = set()  # background rebuilds in flight
+        # Hot leaderboard: keys (-hot, seq), so the hottest question comes first. Ages are
+        # measured from _hot_clock, which only moves in refresh_hot batches; between them
+        # votes, answers and comments just mark the question they touch, and top_hot
+        # re-keys the marked questions in one batch before it reads.
+        self._hot_lock = threading.Lock()
+        self._hot = IndexableSkipList()
+        self._hot_keys = {}  # question seq -> its key in _hot
+        self._hot_dirty = set()  # question seqs whose key may be stale
+        self._hot_clock = datetime.now()
+        # Reputation leaderboard, keys (-reputation, user index). Votes only mark the
+        # author (a set add inside the stripe locks); rank_of/top_users re-key the marked
+        # users in one batch, so the skip list never runs in the writers' critical section.
+        self._rep_lock = threading.Lock()
+        self._reputation = IndexableSkipList()
+        self._rep_keys = {}  # user index -> its key in _reputation
+        self._rep_dirty = set()  # user indexes whose key may be stale
 
     def create_user(self, username, email):
-        user = User(username, email)
-        self.users.append(user)
-        return user
+        with self._write_lock:
+            if username in self._users_by_name:
+                raise ValueError(f"Username {username!r} is already taken")
+            user = User(username, email)
+            self.users.append(user)
+            self._users_by_name[username] = user
+            self._users_by_index[user.index] = user
+            self._rep_dirty.add(user.index)
+            return user
+
+    def _post_lock(self, post):
+        # Answers share their question's stripe: their votes reorder the question's answers
+        if isinstance(post, AnswerBase):
+            post = post.question
+        return self._post_locks[hash(post.id) % len(self._post_locks)]
+
+    def _user_lock(self, user):
+        return self._user_locks[user.index % len(self._user_locks)]
+
+    def get_user(self, username):
+        return self._users_by_name.get(username)
 
     def post_question(self, title, content, author, tag_names):
-        tags = [self._get_or_create_tag(name) for name in tag_names]
-        question = Question(title, content, author, tags)
-        self.questions.append(question)
-        return question
+        term_freqs, doc_len = term_frequencies(title, content)
+        with self._write_lock:
+            tags = [self._get_or_create_tag(name) for name in tag_names]
+            if self.store is None:
+                question = Question(title, content, author, tags)
+            else:
+                question = self.store.views["question"](title, content, author, tags)
+            question.seq = len(self.questions)
+            question.doc_len = doc_len
+            self.questions.append(question)
+            for token, tf in term_freqs.items():
+                self._keyword_tfs[token].append(tf)
+                self._keyword_index[token].append(question.seq)
+            for tag_name in {tag.name for tag in tags}:
+                self._tag_index[tag_name].append(question.seq)
+            self._questions_by_author[author.username].append(question.seq)
+            self._total_len += question.doc_len
+            self._hot_dirty.add(question.seq)
+            return question
 
     def post_answer(self, question, content, author):
-        answer = Answer(content, author, question)
-        question.add_answer(answer)
+        if self.store is None:
+            answer = Answer(content, author, question)
+        else:
+            answer = self.store.views["answer"](content, author, question)
+        with self._post_lock(question):
+            question.add_answer(answer)
+            self._hot_dirty.add(question.seq)
         return answer
 
+    def accept_answer(self, question, answer):
+        with self._post_lock(question):
+            question.accept_answer(answer)
+
+    def ordered_answers(self, question, limit=None):
+        # Locked read: a concurrent vote may be moving an answer within the order
+        with self._post_lock(question):
+            return question.ordered_answers(limit)
+
     def post_comment(self, post, content, author):
-        comment = Comment(content, author)
-        post.add_comment(comment)
+        if self.store is None:
+            comment = Comment(content, author)
+        else:
+            comment = self.store.views["comment"](content, author)
+        with self._post_lock(post):
+            post.add_comment(comment)
+            if isinstance(post, QuestionBase):
+                self._hot_dirty.add(post.seq)
         return comment
 
     def vote(self, post, user, vote_type):
-        vote = Vote(user, vote_type)
-        post.add_vote(vote)
+        # One vote per user per post; returns the change in score and author reputation
+        if vote_type not in (Vote.UPVOTE, Vote.DOWNVOTE, Vote.RETRACT):
+            raise ValueError(f"Unknown vote type {vote_type!r}")
+        with self._post_lock(post), self._user_lock(post.author):
+            delta = post.add_vote(Vote(user, vote_type), self.reputation_rules[post.KIND])
+            if delta:
+                self._rep_dirty.add(post.author.index)
+        if delta and isinstance(post, QuestionBase):
+            self._hot_dirty.add(post.seq)
+            self._voted_since_boosts.add(post.seq)
+        return delta
 
-    def search_by_keyword(self, keyword):
+    def retract_vote(self, post, user):
+        return self.vote(post, user, Vote.RETRACT)
+
+    def audit_votes(self, post):
+        # Materialise the full vote list of a post
         return [
-            q
-            for q in self.questions
-            if keyword.lower() in q.title.lower()
-            or keyword.lower() in q.content.lower()
+            Vote(self._users_by_index[index], vote_type)
+            for index, vote_type in (post._votes or {}).items()
         ]
 
+    def search_by_keyword(self, keyword):
+        # Questions containing every word of keyword (as whole words)
+        return self.search(keyword, mode="and")
+
+    def search(self, query, mode="and"):
+        # mode "and": all query words must appear, "or": any of them
+        postings = [self._keyword_index.get(token, []) for token in set(tokenize(query))]
+        if not postings:
+            return []
+        seqs = intersect_sorted(postings) if mode == "and" else union_sorted(postings)
+        return [self.questions[seq] for seq in seqs]
+
+    @staticmethod
+    def _term_weight(tf, doc_len, avgdl):
+        # BM25 term-frequency part; multiplied by the term's idf when scoring
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_len / avgdl)
+        return tf * (BM25_K1 + 1) / (tf + norm)
+
+    def _in_background(self, key, rebuild, *args):
+        # Run rebuild(*args) on a daemon thread unless the one for key is still running
+        with self._rebuild_lock:
+            if key in self._rebuilding:
+                return
+            self._rebuilding.add(key)
+
+        def run():
+            try:
+                rebuild(*args)
+            finally:
+                with self._rebuild_lock:
+                    self._rebuilding.discard(key)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _refresh_bm25(self):
+        docs = self._bm25[0]
+        n = len(self.questions)
+        if n and not docs:
+            self._next_epoch()  # first search: nothing is cached yet, so this is O(1)
+        elif n > docs * 1.01:
+            self._in_background("epoch", self._next_epoch)
+
+    def _next_epoch(self):
+        with self._write_lock:
+            n = len(self.questions)
+            avgdl = self._total_len / n
+        impacts = {token: self._rank_postings(token, avgdl) for token in list(self._bm25[2])}
+        self._bm25 = (n, avgdl, impacts)
+
+    def _rank_postings(self, token, avgdl):
+        # -> (postings covered, [(impact, seq)] desc)
+        postings = self._keyword_index.get(token, [])
+        covered = len(postings)
+        tfs = self._keyword_tfs[token] if covered else ()
+        questions = self.questions
+        ranked = []
+        for seq, tf in zip(postings[:covered], tfs[:covered]):
+            ranked.append((self._term_weight(tf, questions[seq].doc_len, avgdl), seq))
+        return covered, sorted_descending(ranked)
+
+    def _upfront_bound(self, k):
+        # Up-front scoring costs O(questions) per query, a rebuild O(n) once, so rebuild
+        # once a query would score more than k*log n questions that way
+        return max(UPFRONT_SCORING_MIN, k * math.log2(len(self.questions) + 1))
+
+    def _impact_postings(self, token, bm25, k):
+        # -> (postings sorted by impact, descending; seqs posted since they were built).
+        # A word's first search ranks its postings; later epochs re-rank it and a long
+        # tail of new postings is merged in, both in the background
+        _, avgdl, impacts = bm25
+        cached = impacts.get(token)
+        if cached is None:
+            cached = impacts[token] = self._rank_postings(token, avgdl)
+        recent = self._keyword_index.get(token, [])[cached[0]:]
+        if len(recent) > self._upfront_bound(k):
+            self._in_background(("impacts", token), self._extend_impacts, token, bm25)
+        return cached[1], recent
+
+    def _extend_impacts(self, token, bm25):
+        # Merge the postings added since a word was ranked into its list, same epoch
+        _, avgdl, impacts = bm25
+        covered, ranked = impacts[token]
+        postings = self._keyword_index[token]
+        end = len(postings)
+        tfs = self._keyword_tfs[token]
+        questions = self.questions
+        tail = []
+        for seq, tf in zip(postings[covered:end], tfs[covered:end]):
+            tail.append((self._term_weight(tf, questions[seq].doc_len, avgdl), seq))
+        merged = ranked + tail
+        merged.sort(reverse=True)  # ranked is one sorted run, so this is a linear merge
+        impacts[token] = (end, merged)
+
+    def _boost(self, question):
+        return SCORE_BOOST * math.log1p(max(question.get_score(), 0))
+
+    def _boost_postings(self, k):
+        ranked, voted = self._boosts
+        if sum(map(len, voted)) > self._upfront_bound(k):
+            self._in_background("boosts", self._rebuild_boosts)
+        return ranked, voted
+
+    def _rebuild_boosts(self):
+        # Re-score only the voted questions and merge them into the rest of the old order. Votes go to a fresh set first, so one landing while this
+        # runs is never lost.
+        ranked, voted = self._boosts
+        fresh = set()
+        self._boosts = (ranked, voted + (fresh,))
+        self._voted_since_boosts = fresh
+        changed = set().union(*voted)
+        merged = [entry for entry in ranked if entry[1] not in changed]
+        for seq in changed:
+            boost = self._boost(self.questions[seq])
+            if boost > 0:
+                merged.append((boost, seq))
+        merged.sort(reverse=True)  # one long sorted run plus the re-scored tail: near linear
+        self._boosts = (merged, (fresh,))
+
+    def search_ranked(self, query, k=10, with_scores=False):
+        # Top-k questions by BM25 over title + body plus a boost for the question's votes.
+        # Threshold algorithm over impact-ordered postings (one per query word plus the
+        # vote boosts): read every list one rank at a time, fully score each new question,
+        # and stop once the k-th best score beats the best any unseen question could reach.
+        self._refresh_bm25()
+        bm25 = self._bm25
+        avgdl = bm25[1]
+        n = len(self.questions)
+        terms = [t for t in set(tokenize(query)) if self._keyword_index.get(t)]
+        if not terms or k <= 0:
+            return []
+        idf = {}
+        for t in terms:
+            df = len(self._keyword_index[t])
+            idf[t] = math.log(1 + (n - df + 0.5) / (df + 0.5))
+        top = []  # min-heap of (score, seq), at most k entries
+        seen = set()
+        term_postings = [(idf[t], self._keyword_index[t], self._keyword_tfs[t]) for t in terms]
+
+        def consider(seq):
+            seen.add(seq)
+            q = self.questions[seq]
+            score = 0.0
+            for term_idf, postings, tfs in term_postings:
+                i = bisect_left(postings, seq)  # a question's tf sits next to its posting
+                if i < len(postings) and postings[i] == seq:
+                    score += term_idf * self._term_weight(tfs[i], q.doc_len, avgdl)
+            if not score:
+                return  # reached through the boost list but matches no query word
+            score += self._boost(q)
+            if len(top) < k:
+                heappush(top, (score, seq))
+            elif (score, seq) > top[0]:
+                heapreplace(top, (score, seq))
+
+        lists = []
+        for t in terms:
+            ranked, recent = self._impact_postings(t, bm25, k)
+            for seq in recent:  # posted this epoch, not in the cached order yet
+                if seq not in seen:
+                    consider(seq)
+            lists.append((idf[t], ranked))
+        boosts, voted_recently = self._boost_postings(k)
+        for voted in voted_recently:  # cached boost may be too low for these
+            for seq in list(voted):
+                if seq not in seen:
+                    consider(seq)
+        depth = 0
+        while True:
+            threshold = 0.0
+            exhausted = True  # once every word list is read, every match has been scored
+            for term_idf, ranked in lists:
+                if depth < len(ranked):
+                    exhausted = False
+                    impact, seq = ranked[depth]
+                    threshold += term_idf * impact
+                    if seq not in seen:
+                        consider(seq)
+            if depth < len(boosts):
+                boost, seq = boosts[depth]
+                threshold += boost
+                if seq not in seen:
+                    consider(seq)
+            if exhausted or (len(top) == k and top[0][0] >= threshold):
+                break
+            depth += 1
+        results = sorted(top, reverse=True)
+        if with_scores:
+            return [(self.questions[seq], score) for score, seq in results]
+        return [self.questions[seq] for _, seq in results]
+
+    def _hot_score(self, question):
+        activity = (
+            question.get_score()
+            + HOT_ANSWER_WEIGHT * len(question.answers)
+            + HOT_COMMENT_WEIGHT * len(question.comments)
+        )
+        age_hours = max(0.0, (self._hot_clock - question.timestamp).total_seconds() / 3600)
+        return activity / (age_hours + HOT_AGE_OFFSET_HOURS) ** HOT_GRAVITY
+
+    def _flush_hot(self):
+        # Re-key the questions marked since the last flush at the current clock. Call
+        # with _hot_lock held. set.pop is atomic, so writers may keep marking meanwhile;
+        # a question marked again after its pop is simply re-keyed on the next flush.
+        dirty = self._hot_dirty
+        while dirty:
+            question = self.questions[dirty.pop()]
+            key = (-self._hot_score(question), question.seq)
+            old = self._hot_keys.get(question.seq)
+            if old == key:
+                continue
+            if old is not None:
+                self._hot.remove(old)
+            self._hot.insert(key)
+            self._hot_keys[question.seq] = key
+
+    def refresh_hot(self, now=None):
+        # Batch decay: move the clock and re-rank every question, O(n log n)
+        with self._hot_lock:
+            dirty = self._hot_dirty
+            while dirty:  # the rebuild below reads every question after these marks
+                dirty.pop()
+            self._hot_clock = now or datetime.now()
+            keys = [(-self._hot_score(q), q.seq) for q in self.questions]
+            self._hot = IndexableSkipList(keys)
+            self._hot_keys = {key[1]: key for key in keys}
+
+    def top_hot(self, n=10, now=None):
+        # The n hottest questions in O(n); decay is re-applied at most every HOT_REFRESH
+        if (now or datetime.now()) - self._hot_clock >= HOT_REFRESH:
+            self.refresh_hot(now)
+        with self._hot_lock:
+            self._flush_hot()
+            return [self.questions[seq] for _, seq in itertools.islice(self._hot, n)]
+
+    def _flush_reputation(self):
+        # Re-key the users marked since the last flush; call with _rep_lock held
+        dirty = self._rep_dirty
+        while dirty:
+            user = self._users_by_index[dirty.pop()]
+            key = (-user.reputation, user.index)
+            old = self._rep_keys.get(user.index)
+            if old == key:
+                continue
+            if old is not None:
+                self._reputation.remove(old)
+            self._reputation.insert(key)
+            self._rep_keys[user.index] = key
+
+    def rank_of(self, user):
+        # 1 = highest reputation; ties go to the older account
+        with self._rep_lock:
+            self._flush_reputation()
+            return self._reputation.rank(self._rep_keys[user.index]) + 1
+
+    def top_users(self, k=10):
+        with self._rep_lock:
+            self._flush_reputation()
+            return [self._users_by_index[index] for _, index in itertools.islice(self._reputation, k)]
+
+    def recompute_reputation(self, rules=None, use_numpy=True):
+        # Rebuild every user's reputation from the votes on record, e.g. after a rule
+        # change. Votes are replayed per post as (author index, points) arrays, where
+        # points = upvotes * up rule + downvotes * down rule, and summed per author with
+        # np.bincount (a plain loop without NumPy, or with use_numpy=False). Holding every
+        # user stripe (and the write lock) keeps votes and new users out while it runs.
+        if rules is not None:
+            self.reputation_rules = rules
+        with self._write_lock:
+            for lock in self._user_locks:
+                lock.acquire()
+            try:
+                authors, ups, downs, kinds = [], [], [], []
+                kind_codes = {}
+                for question in self.questions:
+                    for post in itertools.chain((question,), question.answers):
+                        authors.append(post.author.index)
+                        ups.append(post.upvotes)
+                        downs.append(post.downvotes)
+                        kinds.append(kind_codes.setdefault(post.KIND, len(kind_codes)))
+                up_points = [0] * len(kind_codes)
+                down_points = [0] * len(kind_codes)
+                for kind, code in kind_codes.items():
+                    up_points[code] = self.reputation_rules[kind].get(Vote.UPVOTE, 0)
+                    down_points[code] = self.reputation_rules[kind].get(Vote.DOWNVOTE, 0)
+                size = max(self._users_by_index, default=-1) + 1
+                if use_numpy and np is not None and authors:
+                    kinds = np.array(kinds, dtype=np.int64)
+                    points = (
+                        np.array(ups) * np.array(up_points)[kinds]
+                        + np.array(downs) * np.array(down_points)[kinds]
+                    )
+                    totals = np.bincount(np.array(authors), weights=points, minlength=size)
+                    totals = np.rint(totals).astype(np.int64).tolist()
+                else:
+                    totals = [0] * size
+                    for author, up, down, kind in zip(authors, ups, downs, kinds):
+                        totals[author] += up * up_points[kind] + down * down_points[kind]
+                for user in self.users:
+                    user.reputation = totals[user.index]
+                with self._rep_lock:
+                    self._rep_dirty.clear()  # every stripe is held, so nobody is marking
+                    keys = [(-user.reputation, user.index) for user in self.users]
+                    self._reputation = IndexableSkipList(keys)
+                    self._rep_keys = {key[1]: key for key in keys}
+            finally:
+                for lock in self._user_locks:
+                    lock.release()
+
+    def iter_questions(self, query=None, tags=(), author=None, mode="and", cursor=None):
+        # Lazily yields matching questions newest first, optionally only those after
+        # (older than) cursor. Filters combine with AND; mode applies to the query words.
+        # A cursor is the (timestamp, seq) of the last question seen. seqs follow posting
+        # order, so the seq part is what positions the scan and ties on timestamp are safe.
+        before = len(self.questions) if cursor is None else cursor[1]
+        filters = [self._tag_index.get(name, []) for name in set(tags)]
+        if author is not None:
+            filters.append(self._questions_by_author.get(author, []))
+        words = [self._keyword_index.get(token, []) for token in set(tokenize(query or ""))]
+        if query is not None and not words:
+            return
+        if mode == "or" and len(words) > 1:
+            seqs = iter_members_descending(iter_union_descending(words, before), filters)
+        elif words or filters:
+            seqs = iter_intersect_descending(words + filters, before)
+        else:
+            seqs = range(before - 1, -1, -1)
+        for seq in seqs:
+            yield self.questions[seq]
+
+    def page(self, limit=20, cursor=None, **filters):
+        # One page of iter_questions: (questions, next_cursor), next_cursor None at the
+        # end. Reads limit + 1 matches, however deep the cursor is.
+        questions = list(itertools.islice(self.iter_questions(cursor=cursor, **filters), limit + 1))
+        if len(questions) <= limit:
+            return questions, None
+        last = questions[limit - 1]
+        return questions[:limit], (last.timestamp, last.seq)
+
     def search_by_tag(self, tag_name):
-        return [q for q in self.questions if any(t.name == tag_name for t in q.tags)]
+        return [self.questions[seq] for seq in self._tag_index.get(tag_name, [])]
 
-    def search_by_user(self, username):
-        return [q for q in self.questions if q.author.username == username]
+    def search_by_tags(self, tag_names, page=1, page_size=20):
+        # Questions carrying every tag (python AND asyncio), newest first, one page.
+        # seqs grow with posting time, so the newest matches are at the end of the list.
+        seqs = intersect_sorted([self._tag_index.get(name, []) for name in set(tag_names)])
+        end = len(seqs) - (page - 1) * page_size
+        if end <= 0:
+            return []
+        return [self.questions[seq] for seq in reversed(seqs[max(0, end - page_size) : end])]
+
+    def search_by_user(self, username, offset=0, limit=None):
+        # Oldest first, like the other searches; offset/limit slice the author's list
+        seqs = self._questions_by_author.get(username, [])
+        end = len(seqs) if limit is None else offset + limit
+        return [self.questions[seq] for seq in seqs[offset:end]]
 
     def _get_or_create_tag(self, name):
         if name not in self.tags:
@@ -156,6 +1099,7 @@ class StackOverflowDemo:
 
         so.vote(q1, user2, Vote.UPVOTE)
         so.vote(a1, user1, Vote.UPVOTE)
+        so.accept_answer(q1, a1)
 
         print("Search by keyword 'Python':")
         for q in so.search_by_keyword("Python"):
@@ -166,6 +1110,293 @@ class StackOverflowDemo:
         print(user2)
 
 
+# ---------------------------------------------------------------------------------------------------
+# Benchmarks: python "2. Design Stack Overflow.py" bench-search | bench-pages | bench-hot
+#             | bench-answers | bench-reputation | bench-store | bench-contention
+
+WORDS = (
+    "python java rust go async asyncio thread lock list dict set tuple class object "
+    "memory leak error exception import module package install pip numpy pandas "
+    "query index database sql join sort search tree graph heap queue stack string "
+    "regex parse json file path test mock deploy docker build cache http request"
+).split()
+
+
+def build_corpus(num_questions, seed=1):
+    rng = random.Random(seed)
+    # Vocabulary with a Zipf-like word distribution (rank ~ V ** uniform), so a few words
+    # are everywhere and most are rare, like real text
+    vocabulary = WORDS + [f"w{i}" for i in range(5000)]
+    rng.shuffle(vocabulary)
+
+    def words(count):
+        return " ".join(vocabulary[int(len(vocabulary) ** rng.random()) - 1] for _ in range(count))
+
+    so = StackOverflow()
+    users = [so.create_user(f"user{i}", f"user{i}@example.com") for i in range(1000)]
+    tag_pool = WORDS[:20]
+    for n in range(num_questions):
+        so.post_question(words(6), words(rng.randint(10, 40)), rng.choice(users), rng.sample(tag_pool, 3))
+    for _ in range(num_questions // 5):
+        so.vote(so.questions[rng.randrange(num_questions)], rng.choice(users), Vote.UPVOTE)
+    return so
+
+
+def benchmark_search(num_questions=200_000, queries=("python asyncio", "memory leak numpy", "sql join index")):
+    start = time.perf_counter()
+    so = build_corpus(num_questions)
+    print(f"built {num_questions:,} questions in {time.perf_counter() - start:.1f} s")
+    for query in queries:
+        so.search_ranked(query, k=10)  # first call builds the impact-ordered postings
+        start = time.perf_counter()
+        runs = 20
+        for _ in range(runs):
+            top = so.search_ranked(query, k=10, with_scores=True)
+        ranked_ms = (time.perf_counter() - start) / runs * 1000
+        start = time.perf_counter()
+        matches = so.search(query, mode="or")
+        full_ms = (time.perf_counter() - start) * 1000
+        print(
+            f"{query!r:22s} top-10 in {ranked_ms:6.2f} ms "
+            f"(OR query materialises {len(matches):,} matches in {full_ms:6.1f} ms); "
+            f"best: {top[0][1]:.2f}"
+        )
+
+    # Queries while votes and new questions keep landing: ranked lists are rebuilt in
+    # the background, so no single query pays for a rebuild
+    rng = random.Random(5)
+    latencies = []
+    for step in range(20_000):
+        r = rng.random()
+        if r < 0.6:
+            so.vote(so.questions[rng.randrange(num_questions)], rng.choice(so.users), Vote.UPVOTE)
+        elif r < 0.9:
+            source = so.questions[rng.randrange(num_questions)]  # same word distribution
+            so.post_question(source.title, source.content, rng.choice(so.users), [])
+        else:
+            start = time.perf_counter()
+            so.search_ranked(rng.choice(queries), k=10)
+            latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    print(
+        f"{len(latencies):,} queries among {20_000 - len(latencies):,} writes: "
+        f"p50 {latencies[len(latencies) // 2] * 1000:.2f} ms, "
+        f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f} ms, max {latencies[-1] * 1000:.2f} ms"
+    )
+
+
+def benchmark_pages(num_questions=200_000, limit=20):
+    so = build_corpus(num_questions)
+    for label, filters in (
+        ("query 'python'", {"query": "python"}),
+        ("tags python+java", {"tags": ["python", "java"]}),
+        ("'python' OR 'sql'", {"query": "python sql", "mode": "or"}),
+    ):
+        start = time.perf_counter()
+        first, cursor = so.page(limit, **filters)
+        first_ms = (time.perf_counter() - start) * 1000
+        deep, deep_ms, pages = first, first_ms, 1
+        while pages < 102 and cursor is not None:  # page 102, or the last page if sooner
+            start = time.perf_counter()
+            deep, cursor = so.page(limit, cursor, **filters)
+            deep_ms = (time.perf_counter() - start) * 1000
+            pages += 1
+        start = time.perf_counter()
+        everything = list(so.iter_questions(**filters))
+        full_ms = (time.perf_counter() - start) * 1000
+        assert first == everything[:limit] and deep == everything[(pages - 1) * limit : pages * limit]
+        print(
+            f"{label:20s} first page {first_ms:5.2f} ms, page {pages} {deep_ms:5.2f} ms, "
+            f"all {len(everything):,} matches {full_ms:6.1f} ms"
+        )
+
+
+def benchmark_answers(num_answers=20_000, num_votes=100_000, page_size=30):
+    rng = random.Random(6)
+    so = StackOverflow()
+    users = [so.create_user(f"user{i}", f"user{i}@example.com") for i in range(2000)]
+    question = so.post_question("Long thread", "body", users[0], [])
+    answers = [so.post_answer(question, "answer", rng.choice(users)) for _ in range(num_answers)]
+    start = time.perf_counter()
+    for _ in range(num_votes):
+        so.vote(rng.choice(answers), rng.choice(users), rng.choice((Vote.UPVOTE, Vote.DOWNVOTE)))
+    vote_us = (time.perf_counter() - start) / num_votes * 1e6
+    so.accept_answer(question, answers[-1])
+
+    runs = 1000
+    start = time.perf_counter()
+    for _ in range(runs):
+        page = so.ordered_answers(question, page_size)
+    ordered_ms = (time.perf_counter() - start) / runs * 1000
+    start = time.perf_counter()
+    by_score = sorted(question.answers, key=lambda a: (a is not question.accepted_answer, -a.score, a.seq))
+    sort_ms = (time.perf_counter() - start) * 1000
+    assert page == by_score[:page_size]
+    print(
+        f"{num_answers:,} answers: first {page_size} in {ordered_ms:.3f} ms vs sort per view "
+        f"{sort_ms:.1f} ms; vote incl. reordering {vote_us:.1f} us"
+    )
+
+
+def benchmark_hot(num_questions=100_000, n=30):
+    so = build_corpus(num_questions)
+    rng = random.Random(2)
+    now = datetime.now()
+    for q in so.questions:  # spread posting times over the last week
+        q.timestamp = now - timedelta(hours=rng.random() * 168)
+    start = time.perf_counter()
+    so.refresh_hot(now)
+    print(f"refresh_hot over {num_questions:,} questions: {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    updates = 20_000
+    start = time.perf_counter()
+    for _ in range(updates):
+        so.vote(so.questions[rng.randrange(num_questions)], rng.choice(so.users), Vote.UPVOTE)
+    print(f"vote (leaderboard re-key queued): {(time.perf_counter() - start) / updates * 1e6:.1f} us")
+    start = time.perf_counter()
+    so.top_hot(n, now)
+    print(f"first top_hot, applying {updates:,} queued re-keys: {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    runs = 200
+    start = time.perf_counter()
+    for _ in range(runs):
+        top = so.top_hot(n, now)
+    board_ms = (time.perf_counter() - start) / runs * 1000
+    start = time.perf_counter()
+    scan = sorted(so.questions, key=lambda q: (-so._hot_score(q), q.seq))[:n]
+    scan_ms = (time.perf_counter() - start) * 1000
+    assert top == scan
+    print(f"top-{n} hot: leaderboard {board_ms:.3f} ms vs scan + sort {scan_ms:.0f} ms")
+
+
+def benchmark_reputation(num_users=100_000, num_questions=100_000, num_votes=200_000):
+    rng = random.Random(4)
+    start = time.perf_counter()
+    so = StackOverflow()
+    users = [so.create_user(f"user{i}", f"user{i}@example.com") for i in range(num_users)]
+    posts = []
+    for i in range(num_questions):
+        question = so.post_question(f"q{i}", "body", rng.choice(users), [])
+        posts += [question, so.post_answer(question, "answer", rng.choice(users))]
+    for _ in range(num_votes):
+        so.vote(rng.choice(posts), rng.choice(users), rng.choice((Vote.UPVOTE, Vote.UPVOTE, Vote.DOWNVOTE)))
+    print(f"built {num_users:,} users, {len(posts):,} posts, {num_votes:,} votes in {time.perf_counter() - start:.0f} s")
+
+    start = time.perf_counter()
+    so.rank_of(users[0])
+    print(f"first rank_of, applying the queued re-keys: {(time.perf_counter() - start) * 1000:.0f} ms")
+    start = time.perf_counter()
+    for _ in range(1000):
+        so.rank_of(rng.choice(users))
+    rank_us = (time.perf_counter() - start) / 1000 * 1e6
+    start = time.perf_counter()
+    top = so.top_users(100)
+    top_ms = (time.perf_counter() - start) * 1000
+    assert top == sorted(users, key=lambda u: (-u.reputation, u.index))[:100]
+    print(f"rank_of: {rank_us:.1f} us, top_users(100): {top_ms:.2f} ms")
+
+    incremental = [u.reputation for u in users]
+    for label, use_numpy in (("NumPy", True), ("pure Python", False)):
+        if use_numpy and np is None:
+            continue
+        start = time.perf_counter()
+        so.recompute_reputation(use_numpy=use_numpy)
+        print(f"recompute_reputation ({label}): {time.perf_counter() - start:.2f} s")
+        assert [u.reputation for u in users] == incremental
+    rules = {"question": {Vote.UPVOTE: 5, Vote.DOWNVOTE: -2}, "answer": {Vote.UPVOTE: 10, Vote.DOWNVOTE: -2}}
+    start = time.perf_counter()
+    so.recompute_reputation(rules)
+    print(f"recompute with new rules: {time.perf_counter() - start:.2f} s; top user {so.top_users(1)[0]}")
+
+
+def benchmark_store(num_questions=50_000):
+    # Memory per post (questions, answers and comments) for a whole site, with posts as
+    # objects vs views over a PostStore, plus the record part alone
+    class DictRecord:  # the original record layout: instance __dict__, uuid, datetime, str
+        def __init__(self, content, author):
+            self.id = uuid.uuid4()
+            self.content = content
+            self.author = author
+            self.timestamp = datetime.now()
+
+    def build(store):
+        rng = random.Random(8)
+        so = StackOverflow(store=store)
+        users = [so.create_user(f"user{i}", f"user{i}@example.com") for i in range(1000)]
+        for i in range(num_questions):
+            body = " ".join(rng.choice(WORDS) for _ in range(30))
+            question = so.post_question(f"question {i} " + rng.choice(WORDS), body, rng.choice(users), [])
+            so.post_answer(question, body[::-1], rng.choice(users))
+            so.post_comment(question, "thanks, that helped", rng.choice(users))
+        return so, users
+
+    posts = 3 * num_questions
+    for label, store in (("objects", None), ("PostStore views", PostStore())):
+        tracemalloc.start()
+        start = time.perf_counter()
+        so, users = build(store)
+        elapsed = time.perf_counter() - start
+        used, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"site with {label:16s} {used / posts:7.1f} bytes/post (built in {elapsed:.1f} s)")
+        del so
+
+    texts = [" ".join(WORDS[i % 50 : i % 50 + 30]) for i in range(posts)]
+    text_bytes = sum(len(text.encode()) for text in texts) / posts
+    tracemalloc.start()
+    records = [DictRecord(text.encode().decode(), users[0]) for text in texts]  # own copies
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del records
+    store = PostStore()
+    for text in texts:
+        store.add("answer", users[0], text)
+    print(
+        f"record only ({text_bytes:.0f} bytes of text each): __dict__ + uuid + datetime + str "
+        f"{used / posts:.1f} bytes/post, PostStore columns {store.nbytes() / posts:.1f} bytes/post"
+    )
+
+
+def benchmark_contention(num_posts=20_000, num_users=5_000, votes_per_thread=50_000):
+    # Writers vote on random posts from several threads; afterwards every author's
+    # reputation must equal the summed scores of their posts (no lost updates)
+    so = StackOverflow(lock_stripes=64)
+    users = [so.create_user(f"user{i}", f"user{i}@example.com") for i in range(num_users)]
+    posts = [so.post_question(f"q{i}", "body", users[i % num_users], []) for i in range(num_posts)]
+    for threads in (1, 2, 4, 8):
+
+        def voter(seed):
+            rng = random.Random(seed)
+            for _ in range(votes_per_thread):
+                so.vote(rng.choice(posts), rng.choice(users), rng.choice((Vote.UPVOTE, Vote.DOWNVOTE, Vote.RETRACT)))
+
+        workers = [threading.Thread(target=voter, args=(threads * 100 + i,)) for i in range(threads)]
+        start = time.perf_counter()
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        elapsed = time.perf_counter() - start
+        expected = defaultdict(int)
+        for post in posts:
+            expected[post.author.index] += post.get_score()
+        assert all(u.reputation == expected[u.index] for u in users), "lost reputation update"
+        assert so.top_users(50) == sorted(users, key=lambda u: (-u.reputation, u.index))[:50]
+        print(f"{threads} threads: {threads * votes_per_thread / elapsed:10,.0f} votes/sec, no lost updates")
+
+
 # Run demo
 if __name__ == "__main__":
+    commands = {
+        "bench-pages": benchmark_pages,
+        "bench-answers": benchmark_answers,
+        "bench-hot": benchmark_hot,
+        "bench-reputation": benchmark_reputation,
+        "bench-store": benchmark_store,
+        "bench-contention": benchmark_contention,
+        "bench-search": benchmark_search,
+    }
+    if len(sys.argv) > 1 and sys.argv[1] in commands:
+        commands[sys.argv[1]]()
+        sys.exit()
     StackOverflowDemo.run()